@@ -1,7 +1,7 @@
 # -*- mode: python ; coding: utf-8 -*-
 from PyInstaller.utils.hooks import collect_submodules
 
-hiddenimports = ['utils', 'text_utils']
+hiddenimports = ['utils', 'text_utils', 'datastore', 'jsonfile', 'notifications', 'treatments', 'treatment_parser']
 hiddenimports += collect_submodules('llm')
 hiddenimports += collect_submodules('views')
 
@@ -24,9 +24,10 @@ import os
 import base64
 import multiprocessing
 from pathlib import Path
-import threading 
 
-from utils import load_user_data, clear_user_data
+from utils import load_user_data, user_data_exists, clear_user_data
+from notifications import notification_scheduler
+from llm.model_manager import model_manager
 from views.logo import build_logo_view
 from views.privacy import build_privacy_view
 from views.onboarding import (
@@ -62,11 +63,8 @@ if sys.platform == "win32":
 
 # --- Rutas de datos y assets ---
 BASE_DIR   = Path(__file__).parent
-DATA_FILE  = APPDATA_DIR / "gemi_user_data.json"
 LOGO_FILE  = BASE_DIR / "gemi_logo.png"
 
-TIMERS: list[threading.Timer] = []
-
 async def main(page: ft.Page):
     # ──────────────────────────────────────────────────────────────
     # Configuración general de la página
@@ -86,13 +84,12 @@ async def main(page: ft.Page):
     page.update()
     
     async def on_close(e):
-        for t in TIMERS:
-            t.cancel()
-        page.on_close = on_close
+        notification_scheduler.shutdown()
+    page.on_close = on_close
     
 
     # Carga (o inicializa) el estado de la aplicación
-    app_state = load_user_data(DATA_FILE)
+    app_state = load_user_data()
     app_state.setdefault("gender", None)
 
     # Codifica el logo en base64 para el splash
@@ -110,10 +107,10 @@ async def main(page: ft.Page):
         if route == "/":
             page.views.append(build_logo_view(page, logo_data_uri))
             page.update()
-            # Inicializa el LLM en background (logs silenciados)
-            llm_task = asyncio.get_event_loop().run_in_executor(None, lambda: None)
+            # Con la ventana ya pintada, carga el LLM en background (logs
+            # silenciados); las vistas esperan a model_manager cuando lo usan
+            model_manager.start()
             await asyncio.sleep(2)
-            await llm_task
             page.go("/privacy")
             return
 
@@ -130,7 +127,7 @@ async def main(page: ft.Page):
             return
 
         # 4) Si ya existe perfil y entran a /session, saltar a /main
-        profile_exists = DATA_FILE.exists() and DATA_FILE.stat().st_size > 0
+        profile_exists = user_data_exists()
         if profile_exists and route == "/session":
             page.go("/main")
             return
@@ -0,0 +1,122 @@
+# bench/calendar_index.py
+"""
+Micro-benchmark del calendario de tomas.
+
+50 tratamientos durante 1 año (cada 6-12 h). Compara el recorrido
+anterior (listas de tomas materializadas: any() por celda y ordenar
+todos los horarios en cada clic) con DoseIndex: pintar los 12 meses,
+elegir cada día y añadir un tratamiento. Comprueba además que
+ambos dan las mismas tomas.
+
+    python -m bench.calendar_index
+"""
+import calendar
+import sys
+import time
+from datetime import datetime, timedelta
+
+from treatments import DoseIndex, Recurrence
+
+TREATMENTS = 50
+YEAR = 2026
+START = datetime(YEAR, 1, 1, 8, 0)
+
+
+def make_treatments(n: int = TREATMENTS) -> list[dict]:
+    treatments = []
+    for i in range(n):
+        hours = 6 + i % 7
+        count = 365 * 24 // hours
+        rule = Recurrence(START + timedelta(minutes=17 * i), timedelta(hours=hours), count=count)
+        treatments.append({"id": i + 1, "medicine": f"Med {i:02d}", "rule": rule})
+    return treatments
+
+
+# ─── Recorrido anterior (listas materializadas) ────────────────
+def naive_month(schedules: list[dict], year: int, month: int) -> set[int]:
+    all_doses = [dt for t in schedules for dt in t["schedule"]]
+    days = set()
+    for week in calendar.monthcalendar(year, month):
+        for day in week:
+            if day and any(dt.date() == datetime(year, month, day).date() for dt in all_doses):
+                days.add(day)
+    return days
+
+
+def naive_day(schedules: list[dict], day) -> list[tuple]:
+    items = []
+    for t in sorted(schedules, key=lambda x: x["medicine"]):
+        for dt in sorted(t["schedule"]):
+            if dt.date() == day:
+                items.append((dt, t["medicine"]))
+    return sorted(items)
+
+
+# ─── Índice ────────────────────────────────────────────────────
+def indexed_month(index: DoseIndex, year: int, month: int) -> set[int]:
+    return index.days_with_doses(year, month)
+
+
+def indexed_day(index: DoseIndex, day) -> list[tuple]:
+    return [(dt, med) for dt, med, _ in index.on_day(day)]
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def main() -> int:
+    treatments = make_treatments()
+    end = START + timedelta(days=366)
+    schedules = [
+        {"medicine": t["medicine"], "schedule": list(t["rule"].between(START, end))}
+        for t in treatments
+    ]
+    total = sum(len(s["schedule"]) for s in schedules)
+    print(f"{TREATMENTS} treatments, {total} doses in {YEAR}")
+
+    index = DoseIndex(treatments)
+    days = [START.date() + timedelta(days=d) for d in range(365)]
+    ok = True
+
+    naive_ms = cold_ms = warm_ms = 0.0
+    for month in range(1, 13):
+        a, ms_a = _timed(naive_month, schedules, YEAR, month)
+        b, ms_b = _timed(indexed_month, index, YEAR, month)
+        _, ms_c = _timed(indexed_month, index, YEAR, month)
+        naive_ms += ms_a
+        cold_ms += ms_b
+        warm_ms += ms_c
+        ok &= a == b
+    print(f"render 12 months:  naive {naive_ms:9.1f} ms   "
+          f"index {cold_ms:7.2f} ms (first time), {warm_ms:.2f} ms (indexed)")
+
+    # Clics de día: el recorrido anterior es muy lento, se mide un día de cada semana
+    sample = days[::7]
+    naive_ms = sum(_timed(naive_day, schedules, d)[1] for d in sample) / len(sample)
+    indexed_ms = 0.0
+    for d in days:
+        items, ms = _timed(indexed_day, index, d)
+        indexed_ms += ms
+        if d in sample:
+            ok &= items == naive_day(schedules, d)
+    indexed_ms /= len(days)
+    print(f"select one day:    naive {naive_ms:9.3f} ms   index {indexed_ms:7.4f} ms")
+
+    extra = {"id": 999, "medicine": "Extra",
+             "rule": Recurrence(START, timedelta(hours=8), count=3 * 365)}
+    _, add_ms = _timed(index.add, extra)
+    ok &= any(med == "Extra" for _, med, _ in index.on_day(days[100]))
+    print(f"add one treatment (12 months indexed): {add_ms:.2f} ms")
+
+    if not ok:
+        print("FAIL: index and naive scan disagree")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
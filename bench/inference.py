@@ -0,0 +1,238 @@
+# bench/inference.py
+"""
+Benchmark offline de inferencia (Medichat y emergencias).
+
+Ejecuta un corpus fijo contra el backend configurado (o el stub si el
+GGUF no está disponible o con --stub) y mide por petición: time-to-first-token, tokens/s
+de evaluación del prompt y de generación, latencia total (p50/p95) y el
+pico de RSS del proceso, además de la espera en la cola del scheduler
+por prioridad. Escribe los resultados en JSON para comparar
+perfiles de ejecución y cuantizaciones entre versiones.
+
+    python -m bench [--stub] [--repeat 3] [--out results.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+from datastore import DataStore
+from llm import gemma_wrapper, prompt_builder
+from llm.backends.stub import StubBackend
+from llm.chat_store import ChatStore
+from llm.model_manager import model_manager
+from llm.response_cache import ResponseCache
+from llm.runtime_profile import load_profile
+from llm.scheduler import scheduler
+from utils import stream_gemma_emergency_async
+
+# Velocidades simuladas del stub (tokens/s), del orden de un CPU portátil
+STUB_PROMPT_TPS = 400.0
+STUB_GEN_TPS    = 25.0
+
+CHAT_CORPUS = [
+    "Hi Gemi, I have had a headache since this morning.",
+    "It gets worse when I look at screens. Should I worry?",
+    "What can I take for it if I am allergic to aspirin?",
+    "How much water should I drink per day?",
+    "Thanks. When should I see a doctor?",
+]
+
+EMERGENCY_CORPUS = [
+    {"profile": {"gender": "Man", "age": 67},
+     "background": ["Hypertension", "Smoking"],
+     "symptoms": ["face", "arm", "speech"]},
+    {"profile": {"gender": "Women", "age": 45},
+     "background": ["Migraine with aura"],
+     "symptoms": ["headache", "nausea"]},
+    {"profile": {"gender": "Man", "age": 30},
+     "background": [],
+     "symptoms": ["dizzy"]},
+    {"profile": {"gender": "Women", "age": 72},
+     "background": ["Atrial fibrillation", "Diabetes"],
+     "symptoms": ["confusion", "arm", "vomit"]},
+]
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+class RssSampler:
+    """
+    Muestrea en segundo plano el RSS del proceso y sus hijos (el worker
+    de inferencia) y guarda el pico.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._proc = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self) -> int:
+        total = self._proc.memory_info().rss
+        for child in self._proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def _measure(kind: str, stats: dict, latency: float) -> dict:
+    ttft = stats.get("ttft")
+    chunks = stats.get("chunks", 0)
+    ctx = stats.get("context_tokens")
+    prompt_tokens = ctx - chunks if ctx is not None else None
+    gen_time = latency - ttft if ttft is not None else None
+    return {
+        "kind": kind,
+        "latency": latency,
+        "ttft": ttft,
+        "prompt_tokens": prompt_tokens,
+        "generated_tokens": chunks,
+        "prompt_tps": prompt_tokens / ttft if prompt_tokens and ttft else None,
+        "gen_tps": (chunks - 1) / gen_time if chunks > 1 and gen_time else None,
+    }
+
+
+async def _run_chat() -> list[dict]:
+    rows = []
+    for text in CHAT_CORPUS:
+        t0 = time.perf_counter()
+        async for _ in gemma_wrapper.medichat_stream_async(text):
+            pass
+        rows.append(_measure("chat", dict(gemma_wrapper.last_stream_stats),
+                             time.perf_counter() - t0))
+    return rows
+
+
+async def _run_emergency() -> list[dict]:
+    rows = []
+    for payload in EMERGENCY_CORPUS:
+        t0 = time.perf_counter()
+        async for _ in stream_gemma_emergency_async(payload):
+            pass
+        rows.append(_measure("emergency", dict(gemma_wrapper.last_stream_stats),
+                             time.perf_counter() - t0))
+    return rows
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def summarize(rows: list[dict]) -> dict:
+    def mean(key):
+        vals = [r[key] for r in rows if r[key] is not None]
+        return statistics.fmean(vals) if vals else None
+
+    latencies = [r["latency"] for r in rows]
+    return {
+        "requests": len(rows),
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "ttft_mean": mean("ttft"),
+        "prompt_tps_mean": mean("prompt_tps"),
+        "gen_tps_mean": mean("gen_tps"),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stub", action="store_true", help="use the stub backend even if a GGUF exists")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus (default 3)")
+    parser.add_argument("--out", type=Path, help="JSON output path (default bench/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    use_stub = args.stub
+    if not use_stub and load_profile()["backend"] in ("worker", "llama_cpp"):
+        try:
+            from llm.backends.llama_cpp_backend import get_model_path
+            get_model_path()
+        except (ImportError, FileNotFoundError):
+            use_stub = True
+            print("GGUF or llama-cpp not available, using the stub backend.")
+    if use_stub:
+        model_manager.install(StubBackend(STUB_PROMPT_TPS, STUB_GEN_TPS))
+
+    with tempfile.TemporaryDirectory() as tmp, RssSampler() as rss:
+        # No tocar el historial ni el perfil reales del usuario
+        prompt_builder.store = DataStore(Path(tmp) / "gemi.db")
+        # Medir generación real: caché de emergencias vacía y sin capacidad
+        gemma_wrapper.emergency_cache = ResponseCache(
+            Path(tmp) / "emergency_cache.json", max_entries=0
+        )
+        load_t0 = time.perf_counter()
+        backend = model_manager.get()
+        load_seconds = time.perf_counter() - load_t0
+
+        rows: list[dict] = []
+        for _ in range(args.repeat):
+            prompt_builder.store.clear_all()
+            prompt_builder.chat_store = ChatStore(prompt_builder.store)
+            rows += asyncio.run(_run_chat())
+            rows += asyncio.run(_run_emergency())
+        prompt_builder.store.close()
+
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "backend": backend.name,
+        "model_id": backend.model_id,
+        "runtime_profile": model_manager.profile,
+        "machine": {"platform": platform.platform(), "python": platform.python_version()},
+        "load_seconds": load_seconds,
+        "peak_rss_bytes": rss.peak,
+        "repeat": args.repeat,
+        "summary": {
+            kind: summarize([r for r in rows if r["kind"] == kind])
+            for kind in ("chat", "emergency")
+        },
+        "scheduler": scheduler.metrics(),
+        "kv_cache": gemma_wrapper.kv_cache_stats(),
+        "requests": rows,
+    }
+
+    out = args.out or RESULTS_DIR / f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{backend.name}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+    for kind, s in result["summary"].items():
+        fmt = lambda v, spec: "n/a" if v is None else format(v, spec)
+        print(f"{kind:<10} p50 {fmt(s['latency_p50'], '.2f')} s  "
+              f"p95 {fmt(s['latency_p95'], '.2f')} s  "
+              f"ttft {fmt(s['ttft_mean'], '.2f')} s  "
+              f"prompt {fmt(s['prompt_tps_mean'], '.1f')} tok/s  "
+              f"gen {fmt(s['gen_tps_mean'], '.1f')} tok/s")
+    for kind, m in result["scheduler"]["classes"].items():
+        if m["jobs"]:
+            print(f"queue {kind:<10} {m['jobs']} jobs  wait avg {m['wait_avg'] * 1000:.1f} ms  "
+                  f"max {m['wait_max'] * 1000:.1f} ms  preempted {m['preempted']}")
+    print(f"peak RSS {rss.peak / 1024 ** 2:.0f} MB → {out}")
+    return 0
@@ -0,0 +1,87 @@
+# bench/prompt_growth.py
+"""
+Regresión de tamaño de prompt en Medichat.
+
+Simula 100 turnos de conversación contra un almacén temporal y
+comprueba que el prompt de build_chat_prompt se mantiene acotado. Cuenta
+tokens con el tokenizador (memorizado) del backend stub.
+
+    python -m bench.prompt_growth
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from datastore import DataStore
+from llm import prompt_builder
+from llm.backends.stub import StubBackend
+from llm.chat_store import ChatStore
+from llm.prompt_builder import (
+    CHAT_PROMPT_BUDGET,
+    build_chat_prompt,
+    save_chat_turn,
+    token_counter,
+)
+
+TURNS = 100
+USER_MSG = "I have had a mild headache since this morning, what should I do?"
+REPLY = (
+    "Rest in a quiet, dark room, drink water and avoid screens. "
+    "If the pain becomes severe, sudden or comes with vomiting, "
+    "confusion or weakness, seek medical attention right away."
+)
+
+
+count_tokens = token_counter(StubBackend().tokenize)
+
+
+def prompt_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m["content"]) for m in messages)
+
+
+def run(turns: int = TURNS) -> list[dict]:
+    results = []
+    for turn in range(1, turns + 1):
+        t0 = time.perf_counter()
+        messages = build_chat_prompt(USER_MSG, count_tokens)
+        build_ms = (time.perf_counter() - t0) * 1000
+        results.append({
+            "turn": turn,
+            "messages": len(messages),
+            "tokens": prompt_tokens(messages),
+            "dropped_turns": prompt_builder.last_prompt_stats["dropped_turns"],
+            "build_ms": build_ms,
+        })
+        t0 = time.perf_counter()
+        save_chat_turn(USER_MSG, REPLY)
+        results[-1]["save_ms"] = (time.perf_counter() - t0) * 1000
+    return results
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt_builder.store = DataStore(Path(tmp) / "gemi.db")
+        prompt_builder.chat_store = ChatStore(prompt_builder.store)
+        results = run()
+        prompt_builder.store.close()
+
+    peak = max(r["tokens"] for r in results)
+    for r in results[:: TURNS // 10] + [results[-1]]:
+        print(f"turn {r['turn']:>3}: {r['messages']:>3} msgs, "
+              f"{r['tokens']:>4} tokens, {r['dropped_turns']:>3} dropped, "
+              f"build {r['build_ms']:.2f} ms, save {r['save_ms']:.2f} ms")
+    print(f"peak prompt tokens: {peak} (budget {CHAT_PROMPT_BUDGET})")
+
+    if peak > CHAT_PROMPT_BUDGET:
+        print("FAIL: prompt exceeds the token budget")
+        return 1
+    if results[-1]["tokens"] > results[TURNS // 2]["tokens"]:
+        print("FAIL: prompt keeps growing with the conversation")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
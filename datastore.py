@@ -0,0 +1,430 @@
+# datastore.py
+"""
+Almacén local único en SQLite (modo WAL) para los datos del usuario:
+documentos clave → valor (datos de usuario, perfil, estado del chat),
+historial de chat, tratamientos con sus tomas y PDFs del perfil.
+
+Las escrituras son por fila y las lecturas por consultas indexadas; el
+esquema se versiona con PRAGMA user_version (ver _MIGRATIONS). Al abrir
+el almacén de la app se importan una sola vez los JSON antiguos.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from jsonfile import load_json
+from treatments import Recurrence, from_schedule
+
+# ─── Carpeta de datos en APPDATA ────────────────────────────────
+APPDATA_DIR = Path(
+    os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
+) / "GemiASD"
+APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+
+DB_PATH = APPDATA_DIR / "gemi.db"
+
+# Documentos (una fila por clave de primer nivel)
+USER_DOC       = "user"         # estado de la app (antes gemi_user_data.json)
+PROFILE_DOC    = "profile"      # perfil editable (antes profile_data.json)
+CHAT_DOC       = "chat"         # resumen del chat, etc.
+
+# JSON de versiones anteriores (se importan una vez)
+_LEGACY_FILES = (
+    "gemi_user_data.json", "profile_data.json", "chat_data.json",
+    "chat_log.jsonl", "chat_summary.json", "medicine_tasks.json",
+)
+
+# Columnas de la regla de un tratamiento (ver treatments.py)
+_RULE_COLUMNS = "start, interval_s, count, until, exceptions"
+
+
+def _rule_row(rule: Recurrence) -> tuple:
+    return (
+        rule.start.isoformat(),
+        rule.interval.total_seconds(),
+        rule.count,
+        rule.until.isoformat() if rule.until else None,
+        json.dumps(sorted(dt.isoformat() for dt in rule.exceptions)),
+    )
+
+
+def _rule_from_row(start, interval_s, count, until, exceptions) -> Recurrence:
+    return Recurrence(
+        datetime.fromisoformat(start),
+        timedelta(seconds=interval_s),
+        count=count,
+        until=datetime.fromisoformat(until) if until else None,
+        exceptions=[datetime.fromisoformat(dt) for dt in json.loads(exceptions)],
+    )
+
+
+def _doses_to_rules(db: sqlite3.Connection) -> None:
+    """
+    v1 → v2: cada tratamiento pasa de una fila por toma (tabla doses) a
+    una regla en la propia fila.
+    """
+    for column in ("start TEXT", "interval_s REAL", "count INTEGER",
+                   "until TEXT", "exceptions TEXT NOT NULL DEFAULT '[]'"):
+        db.execute(f"ALTER TABLE treatments ADD COLUMN {column}")
+
+    schedules: dict[int, list[datetime]] = {}
+    for tid, due in db.execute("SELECT treatment_id, due FROM doses"):
+        schedules.setdefault(tid, []).append(datetime.fromisoformat(due))
+    for tid, medicine, created in db.execute(
+        "SELECT id, medicine, created FROM treatments"
+    ).fetchall():
+        rules = from_schedule(schedules.get(tid, []))
+        if not rules:
+            db.execute("DELETE FROM treatments WHERE id = ?", (tid,))
+            continue
+        db.execute(
+            f"UPDATE treatments SET ({_RULE_COLUMNS}) = (?, ?, ?, ?, ?) WHERE id = ?",
+            (*_rule_row(rules[0]), tid),
+        )
+        # Horario irregular: una fila más por cada toma suelta
+        db.executemany(
+            f"INSERT INTO treatments (medicine, created, {_RULE_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(medicine, created, *_rule_row(rule)) for rule in rules[1:]],
+        )
+
+    db.execute("DROP TABLE doses")
+
+
+# Esquema: cada entrada lleva la base de datos a la versión i + 1
+# (un script SQL o una función que recibe la conexión)
+_MIGRATIONS = [
+    """
+    CREATE TABLE meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE documents (
+        doc     TEXT NOT NULL,
+        key     TEXT NOT NULL,
+        value   TEXT NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (doc, key)
+    );
+    CREATE TABLE chat_messages (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        role    TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE TABLE treatments (
+        id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        medicine TEXT NOT NULL,
+        created  REAL NOT NULL
+    );
+    CREATE TABLE doses (
+        treatment_id INTEGER NOT NULL REFERENCES treatments(id) ON DELETE CASCADE,
+        due          TEXT NOT NULL
+    );
+    CREATE INDEX doses_due ON doses (due);
+    CREATE INDEX doses_treatment ON doses (treatment_id);
+    CREATE TABLE pdf_documents (
+        path  TEXT PRIMARY KEY,
+        name  TEXT NOT NULL,
+        added REAL NOT NULL
+    );
+    """,
+    # v2: tratamientos como reglas de recurrencia (ver treatments.py)
+    _doses_to_rules,
+]
+
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Type {o.__class__.__name__} not serializable")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_default)
+
+
+class DataStore:
+    """
+    Repositorio sobre una conexión SQLite compartida entre hilos (las
+    operaciones se serializan con un lock; otros procesos pueden leer a
+    la vez gracias a WAL).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path, timeout=10.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate()
+
+    def _migrate(self) -> None:
+        with self._tx() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for i, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                if callable(script):
+                    script(db)
+                else:
+                    for statement in script.split(";"):
+                        if statement.strip():
+                            db.execute(statement)
+                db.execute(f"PRAGMA user_version = {i}")
+
+    @contextmanager
+    def _tx(self):
+        """
+        Transacción de escritura (BEGIN IMMEDIATE: otro proceso que
+        escriba espera). Anidada dentro de otra, forma parte de ella.
+        """
+        with self._lock:
+            if self._conn.in_transaction:
+                yield self._conn
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def transaction(self):
+        """Agrupa varias escrituras en una sola transacción atómica."""
+        return self._tx()
+
+    def _query(self, sql: str, params: Iterable = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ─── Meta ──────────────────────────────────────────────────
+    def get_meta(self, key: str) -> str | None:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ─── Documentos ────────────────────────────────────────────
+    def load_document(self, doc: str) -> dict:
+        rows = self._query("SELECT key, value FROM documents WHERE doc = ?", (doc,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def document_exists(self, doc: str) -> bool:
+        return bool(self._query("SELECT 1 FROM documents WHERE doc = ? LIMIT 1", (doc,)))
+
+    def save_document(self, doc: str, data: dict, skip: Iterable[str] = ()) -> None:
+        """
+        Deja el documento igual a `data`: solo se escriben las claves que
+        cambian y se borran las que ya no están. Las claves que empiezan
+        por "_" (referencias a controles de la UI) y las de `skip` no se
+        guardan.
+        """
+        skip = set(skip)
+        new = {
+            key: _dumps(value) for key, value in data.items()
+            if not key.startswith("_") and key not in skip
+        }
+        with self._tx() as db:
+            old = dict(db.execute("SELECT key, value FROM documents WHERE doc = ?", (doc,)))
+            now = time.time()
+            db.executemany(
+                "INSERT OR REPLACE INTO documents (doc, key, value, updated) VALUES (?, ?, ?, ?)",
+                [(doc, k, v, now) for k, v in new.items() if old.get(k) != v],
+            )
+            db.executemany(
+                "DELETE FROM documents WHERE doc = ? AND key = ?",
+                [(doc, k) for k in old if k not in new],
+            )
+
+    def update_document(self, doc: str, changes: dict) -> None:
+        """Escribe solo las claves indicadas, sin tocar el resto."""
+        now = time.time()
+        with self._tx() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO documents (doc, key, value, updated) VALUES (?, ?, ?, ?)",
+                [(doc, k, _dumps(v), now) for k, v in changes.items() if not k.startswith("_")],
+            )
+
+    def get_value(self, doc: str, key: str, default: Any = None) -> Any:
+        rows = self._query("SELECT value FROM documents WHERE doc = ? AND key = ?", (doc, key))
+        return json.loads(rows[0][0]) if rows else default
+
+    def delete_document(self, doc: str) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM documents WHERE doc = ?", (doc,))
+
+    # ─── Chat ──────────────────────────────────────────────────
+    # Los índices de mensaje son absolutos (id - 1) y no se reutilizan
+    # tras compactar; solo chat_clear() vuelve a empezar desde 0.
+    def chat_append(self, messages: Iterable[dict]) -> None:
+        now = time.time()
+        with self._tx() as db:
+            db.executemany(
+                "INSERT INTO chat_messages (role, content, created) VALUES (?, ?, ?)",
+                [(m["role"], m["content"], now) for m in messages],
+            )
+
+    def chat_count(self) -> int:
+        rows = self._query("SELECT seq FROM sqlite_sequence WHERE name = 'chat_messages'")
+        return rows[0][0] if rows else 0
+
+    def chat_read(self, start: int, stop: int | None = None) -> list[dict]:
+        stop = self.chat_count() if stop is None else stop
+        rows = self._query(
+            "SELECT role, content FROM chat_messages WHERE id > ? AND id <= ? ORDER BY id",
+            (start, stop),
+        )
+        return [{"role": r, "content": c} for r, c in rows]
+
+    def chat_recent(self, page: int = 32) -> Iterator[dict]:
+        """Del más reciente al más antiguo, por páginas (consulta por índice)."""
+        before = self.chat_count() + 1
+        while True:
+            rows = self._query(
+                "SELECT id, role, content FROM chat_messages WHERE id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (before, page),
+            )
+            for _, role, content in rows:
+                yield {"role": role, "content": content}
+            if len(rows) < page:
+                return
+            before = rows[-1][0]
+
+    def chat_compact(self, keep: int) -> None:
+        """Borra los mensajes más antiguos dejando los `keep` últimos."""
+        with self._tx() as db:
+            db.execute(
+                "DELETE FROM chat_messages WHERE id <= "
+                "(SELECT COALESCE(MAX(id), 0) FROM chat_messages) - ?",
+                (keep,),
+            )
+
+    def chat_clear(self) -> None:
+        with self._tx() as db:
+            db.execute("DELETE FROM chat_messages")
+            db.execute("DELETE FROM sqlite_sequence WHERE name = 'chat_messages'")
+
+    # ─── Tratamientos ──────────────────────────────────────────
+    def list_treatments(self) -> list[dict]:
+        """Tratamientos con su regla: [{"id", "medicine", "rule"}]."""
+        rows = self._query(f"SELECT id, medicine, {_RULE_COLUMNS} FROM treatments ORDER BY id")
+        return [
+            {"id": tid, "medicine": med, "rule": _rule_from_row(*rule)}
+            for tid, med, *rule in rows
+        ]
+
+    def add_treatment(self, medicine: str, rule: Recurrence) -> int:
+        with self._tx() as db:
+            cur = db.execute(
+                f"INSERT INTO treatments (medicine, created, {_RULE_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (medicine, time.time(), *_rule_row(rule)),
+            )
+        return cur.lastrowid
+
+    # ─── PDFs del perfil ───────────────────────────────────────
+    def list_pdfs(self) -> list[str]:
+        return [p for (p,) in self._query("SELECT path FROM pdf_documents ORDER BY added, path")]
+
+    def sync_pdfs(self, paths: Iterable[str]) -> None:
+        """Deja en la tabla exactamente `paths` (altas y bajas por fila)."""
+        paths = list(dict.fromkeys(paths))
+        with self._tx() as db:
+            old = {p for (p,) in db.execute("SELECT path FROM pdf_documents")}
+            now = time.time()
+            db.executemany(
+                "INSERT INTO pdf_documents (path, name, added) VALUES (?, ?, ?)",
+                [(p, Path(p).name, now + i * 1e-6) for i, p in enumerate(paths) if p not in old],
+            )
+            db.executemany(
+                "DELETE FROM pdf_documents WHERE path = ?",
+                [(p,) for p in old if p not in set(paths)],
+            )
+
+    # ─── Borrado e importación ─────────────────────────────────
+    def clear_all(self) -> None:
+        with self._tx() as db:
+            for table in ("documents", "chat_messages", "treatments", "pdf_documents"):
+                db.execute(f"DELETE FROM {table}")
+            db.execute("DELETE FROM sqlite_sequence")
+
+    def import_json_files(self, data_dir: Path) -> bool:
+        """
+        Importa una sola vez los JSON de versiones anteriores y los deja
+        renombrados como *.imported. Devuelve True si importó algo.
+        """
+        with self._tx():
+            if self.get_meta("json_imported"):
+                return False
+            self._import_json(data_dir)
+            self.set_meta("json_imported", datetime.now().isoformat(timespec="seconds"))
+
+        imported = False
+        for name in _LEGACY_FILES:
+            path = data_dir / name
+            if path.exists():
+                os.replace(path, path.with_name(path.name + ".imported"))
+                imported = True
+        return imported
+
+    def _import_json(self, data_dir: Path) -> None:
+        def read(name: str, default):
+            return load_json(data_dir / name, default)
+
+        user = read("gemi_user_data.json", {})
+        profile = read("profile_data.json", {})
+        summary = read("chat_summary.json", {})
+        treatments = read("medicine_tasks.json", [])
+        if isinstance(treatments, dict):
+            treatments = [treatments]
+
+        chat = []
+        log = data_dir / "chat_log.jsonl"
+        if log.exists():
+            for line in log.read_text(encoding="utf-8", errors="ignore").splitlines():
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if rec.get("role") in ("user", "assistant"):
+                    chat.append(rec)
+        else:
+            chat = [m for m in read("chat_data.json", [])
+                    if isinstance(m, dict) and m.get("role") in ("user", "assistant")]
+
+        if isinstance(user, dict) and user:
+            self.save_document(USER_DOC, user, skip=("treatments", "chat_messages"))
+        if isinstance(profile, dict) and profile:
+            self.save_document(PROFILE_DOC, profile, skip=("studies",))
+            self.sync_pdfs(p for p in profile.get("studies", []) if isinstance(p, str))
+        if chat:
+            self.chat_append(chat)
+        if isinstance(summary, dict) and summary.get("summary"):
+            self.update_document(CHAT_DOC, summary)
+        for t in treatments:
+            if isinstance(t, dict) and t.get("medicine"):
+                try:
+                    schedule = [datetime.fromisoformat(dt) for dt in t.get("schedule", [])]
+                except (TypeError, ValueError):
+                    continue
+                for rule in from_schedule(schedule):
+                    self.add_treatment(t["medicine"], rule)
+
+
+store = DataStore(DB_PATH)
+store.import_json_files(APPDATA_DIR)
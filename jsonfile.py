@@ -0,0 +1,136 @@
+# jsonfile.py
+"""
+Ficheros JSON a prueba de cortes.
+
+save_json() escribe en un temporal (serializando por trozos con
+iterencode, sin construir el texto entero en memoria), hace fsync y lo
+renombra sobre el original; la versión anterior queda como copia
+"<nombre>.bak". Cada fichero empieza con una cabecera con el SHA-256 y
+el tamaño del cuerpo, así load_json() detecta un fichero truncado o
+corrupto y recupera la copia en lugar de devolver {} y perder los datos.
+
+Los JSON antiguos sin cabecera se siguen leyendo tal cual. Los ficheros
+pensados para editarse a mano se guardan sin cabecera (checksum=False):
+con ella, cualquier edición contaría como corrupción.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+# Cabecera de ancho fijo: se reserva al empezar y se rellena al terminar
+_MAGIC = b"#gemi-json v1"
+_HEADER_LEN = len(_MAGIC) + len(" sha256=") + 64 + len(" size=") + 20 + 1
+
+
+class CorruptJSONError(ValueError):
+    """El fichero no coincide con su cabecera o no es JSON válido."""
+
+
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Type {o.__class__.__name__} not serializable")
+
+
+def _header(digest: str, size: int) -> bytes:
+    return _MAGIC + f" sha256={digest} size={size:020d}\n".encode("ascii")
+
+
+def backup_path(path: Path) -> Path:
+    return path.with_name(path.name + ".bak")
+
+
+def _fsync_dir(path: Path) -> None:
+    # Persiste el rename; en Windows no se pueden abrir carpetas
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_json(
+    data: Any, path: Path, indent: int | None = 2,
+    backup: bool = True, checksum: bool = True,
+) -> None:
+    """
+    Guarda `data` de forma atómica (los datetime pasan a ISO). Si
+    backup=True, la versión anterior se conserva como <nombre>.bak; con
+    checksum=False se escribe JSON plano, sin cabecera.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    encoder = json.JSONEncoder(ensure_ascii=False, indent=indent, default=_default)
+    sha = hashlib.sha256()
+    size = 0
+    with open(tmp, "wb") as fh:
+        if checksum:
+            fh.write(b" " * _HEADER_LEN)
+        for chunk in encoder.iterencode(data):
+            raw = chunk.encode("utf-8")
+            sha.update(raw)
+            size += len(raw)
+            fh.write(raw)
+        if checksum:
+            fh.seek(0)
+            fh.write(_header(sha.hexdigest(), size))
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    if backup and path.exists():
+        os.replace(path, backup_path(path))
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+
+def _read(path: Path) -> Any:
+    raw = path.read_bytes()
+    if raw.startswith(_MAGIC):
+        header, body = raw[:_HEADER_LEN], raw[_HEADER_LEN:]
+        try:
+            fields = dict(f.split("=", 1) for f in header.decode("ascii").split()[2:])
+            digest, size = fields["sha256"], int(fields["size"])
+        except (UnicodeDecodeError, ValueError, KeyError):
+            raise CorruptJSONError(f"{path.name}: bad header")
+        if len(body) != size or hashlib.sha256(body).hexdigest() != digest:
+            raise CorruptJSONError(f"{path.name}: checksum mismatch")
+    else:
+        body = raw
+    try:
+        text = body.decode("utf-8").strip()
+        return json.loads(text) if text else None
+    except (UnicodeDecodeError, json.JSONDecodeError) as ex:
+        raise CorruptJSONError(f"{path.name}: {ex}")
+
+
+def load_json(path: Path, default: Any = None) -> Any:
+    """
+    Carga un JSON guardado con save_json() (o uno antiguo sin cabecera).
+    Si está dañado se aparta como <nombre>.corrupt y se usa la copia
+    .bak; si no hay nada legible devuelve `default` ({} por defecto).
+    """
+    default = {} if default is None else default
+    bak = backup_path(path)
+    try:
+        data = _read(path)
+        return default if data is None else data
+    except FileNotFoundError:
+        pass
+    except (OSError, CorruptJSONError) as ex:
+        print(f"[jsonfile] {ex}; trying backup")
+        try:
+            os.replace(path, path.with_name(path.name + ".corrupt"))
+        except OSError:
+            pass
+
+    # Sin fichero principal (corte entre los dos renames) o dañado
+    try:
+        data = _read(bak)
+    except (OSError, CorruptJSONError):
+        return default
+    return default if data is None else data
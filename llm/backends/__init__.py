@@ -0,0 +1,30 @@
+# llm/backends/__init__.py
+from .base import LLMBackend
+
+BACKENDS = ("worker", "llama_cpp", "stub", "server")
+
+
+def create_backend(profile: dict) -> LLMBackend:
+    """
+    Construye el motor indicado en el perfil de ejecución ("backend").
+    Los imports son perezosos: el stub no necesita llama-cpp.
+    """
+    name = profile.get("backend", "worker")
+    if name == "worker":
+        from .worker import WorkerBackend
+
+        return WorkerBackend()
+    if name == "llama_cpp":
+        from .llama_cpp_backend import LlamaCppBackend
+        from ..runtime_profile import llama_kwargs
+
+        return LlamaCppBackend(llama_kwargs(profile))
+    if name == "stub":
+        from .stub import StubBackend
+
+        return StubBackend()
+    if name == "server":
+        from .server import ServerBackend, DEFAULT_URL
+
+        return ServerBackend(profile.get("server_url") or DEFAULT_URL)
+    raise ValueError(f"Unknown LLM backend {name!r} (expected one of {BACKENDS})")
@@ -0,0 +1,27 @@
+# llm/backends/base.py
+from typing import Iterator, Protocol
+
+
+class LLMBackend(Protocol):
+    """
+    Interfaz común de los motores de inferencia.
+
+    Los mensajes usan el formato de chat {"role", "content"}. Los kwargs
+    de generación admitidos son temperature, top_p, max_tokens y grammar
+    (texto GBNF). stream() entrega deltas de texto; dejar de iterar
+    cancela la generación. Los motores con caché de prefijos KV añaden
+    kv_cache_stats() -> dict (ver gemma_wrapper.kv_cache_stats).
+    """
+
+    name: str
+    model_id: str
+    # Tokens en contexto tras la última generación (None si no se sabe)
+    context_tokens: int | None
+
+    def complete(self, messages: list[dict], **kw) -> str: ...
+
+    def stream(self, messages: list[dict], **kw) -> Iterator[str]: ...
+
+    def tokenize(self, text: str) -> list[int]: ...
+
+    def embed(self, text: str) -> list[float]: ...
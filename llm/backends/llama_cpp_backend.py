@@ -0,0 +1,180 @@
+# llm/backends/llama_cpp_backend.py
+import contextlib
+import hashlib
+import os, sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator
+
+from llama_cpp import Llama, LlamaGrammar
+from llama_cpp.llama_chat_format import format_gemma
+
+from ..kv_cache import PrefixCache, save_snapshot, load_snapshot
+
+# Bytes leídos del principio y del final del .gguf para su huella
+_FINGERPRINT_BYTES = 1 << 20
+
+
+def get_model_path() -> Path:
+    """
+    Devuelve la ruta al .gguf:
+     - Si estamos en un EXE --onefile, mira en sys._MEIPASS/models/…
+     - En desarrollo, mira en <project_root>/models/…
+    """
+    rel = Path("models") / "gemma3n" / "gemma-3n-2b-it-gguf" / "gemma-3n-E2B-it-Q4_K_M.gguf"
+
+    if getattr(sys, "_MEIPASS", None):
+        base = Path(sys._MEIPASS)
+    else:
+        base = Path(__file__).parent.parent.parent
+
+    model_path = base / rel
+    if not model_path.exists():
+        raise FileNotFoundError(
+            f"Gemma model not found at {model_path!r}\n"
+            "  • En local, asegúrate de tener ./models/gemma3n/gemma-3n-2b-it-gguf/…\n"
+            "  • En EXE, compílalo con --add-data \"models;models\""
+        )
+    return model_path
+
+
+def model_fingerprint(model_path: Path) -> str:
+    """
+    Huella barata del modelo (tamaño + primer y último MB), para no leer
+    el .gguf entero al arrancar.
+    """
+    h = hashlib.sha256(str(model_path.stat().st_size).encode())
+    with open(model_path, "rb") as fh:
+        h.update(fh.read(_FINGERPRINT_BYTES))
+        fh.seek(max(model_path.stat().st_size - _FINGERPRINT_BYTES, 0))
+        h.update(fh.read(_FINGERPRINT_BYTES))
+    return h.hexdigest()[:16]
+
+
+def _fold_system(messages: list[dict]) -> list[dict]:
+    """
+    Gemma no tiene rol de sistema y el chat_format "gemma" de llama-cpp
+    lo descarta: se antepone al primer turno de usuario, como hace la
+    plantilla oficial del modelo.
+    """
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    rest = [m for m in messages if m["role"] != "system"]
+    if not system:
+        return rest
+    if rest and rest[0]["role"] == "user":
+        return [{"role": "user", "content": f"{system}\n\n{rest[0]['content']}"}, *rest[1:]]
+    return [{"role": "user", "content": system}, *rest]
+
+
+@lru_cache(maxsize=None)
+def _compile_grammar(gbnf: str) -> LlamaGrammar:
+    return LlamaGrammar.from_string(gbnf, verbose=False)
+
+
+class LlamaCppBackend:
+    """
+    Gemma en proceso con llama-cpp-python, con caché de prefijos KV.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, llama_kwargs: dict):
+        model_path = get_model_path()
+        self.model_path = model_path
+        self.model_id = model_path.name
+        self.llama_kwargs = llama_kwargs
+        # Cargamos el modelo sin imprimir logs en consola
+        with open(os.devnull, "w") as fnull, \
+                contextlib.redirect_stdout(fnull), contextlib.redirect_stderr(fnull):
+            self.llm = Llama(
+                model_path=str(model_path),
+                chat_format="gemma",
+                verbose=False,
+                **llama_kwargs,
+            )
+        # Reutiliza el KV del prefijo común (sistema + historial) entre turnos
+        self.kv_cache = PrefixCache()
+        self.llm.set_cache(self.kv_cache)
+
+    @property
+    def context_tokens(self) -> int:
+        return self.llm.n_tokens
+
+    def _kwargs(self, kw: dict) -> dict:
+        gbnf = kw.pop("grammar", None)
+        if gbnf:
+            kw["grammar"] = _compile_grammar(gbnf)
+        return kw
+
+    def _prompt_tokens(self, messages: list[dict]) -> list[int]:
+        # Igual que el handler de chat de llama-cpp para chat_format="gemma"
+        prompt = format_gemma(messages=_fold_system(messages)).prompt
+        return self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+
+    def warm_up(self, system_prompts: list[list[dict]], snapshot_dir: Path | None = None) -> int:
+        """
+        Evalúa una vez el prefijo fijo de cada prompt de sistema y fija su
+        estado KV en la caché: la primera petición de la sesión ya no
+        reevalúa esos tokens. Con snapshot_dir los estados se guardan y
+        reutilizan en disco, con clave huella del modelo + prefijo + n_ctx.
+        Devuelve el número de tokens evaluados.
+        """
+        fingerprint = model_fingerprint(self.model_path) if snapshot_dir else ""
+        evaluated = 0
+        for system in system_prompts:
+            # Prefijo estable: lo común a dos turnos de usuario distintos
+            a = self._prompt_tokens([*system, {"role": "user", "content": "a"}])
+            b = self._prompt_tokens([*system, {"role": "user", "content": "b"}])
+            prefix = a[: Llama.longest_token_prefix(a, b)]
+            if not prefix:
+                continue
+
+            path = state = None
+            if snapshot_dir is not None:
+                key = hashlib.sha256(repr((
+                    prefix,
+                    self.llama_kwargs.get("n_ctx"),
+                    self.llama_kwargs.get("flash_attn"),
+                    self.llama_kwargs.get("embedding"),
+                )).encode()).hexdigest()[:16]
+                path = snapshot_dir / f"{fingerprint}-{key}.state"
+                state = load_snapshot(path)
+            if state is None:
+                self.llm.reset()
+                self.llm.eval(prefix)
+                state = self.llm.save_state()
+                evaluated += len(prefix)
+                if path is not None:
+                    save_snapshot(path, state)
+            self.kv_cache.pin(prefix, state)
+        return evaluated
+
+    def complete(self, messages: list[dict], **kw) -> str:
+        messages = _fold_system(messages)
+        out = self.llm.create_chat_completion(messages=messages, **self._kwargs(kw))
+        return out["choices"][0]["message"]["content"].strip()
+
+    def stream(self, messages: list[dict], **kw) -> Iterator[str]:
+        messages = _fold_system(messages)
+        chunks = self.llm.create_chat_completion(
+            messages=messages, stream=True, **self._kwargs(kw)
+        )
+        for chunk in chunks:
+            delta = chunk["choices"][0]["delta"].get("content")
+            if delta:
+                yield delta
+
+    def tokenize(self, text: str) -> list[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def kv_cache_stats(self) -> dict:
+        return self.kv_cache.stats()
+
+    def embed(self, text: str) -> list[float]:
+        # El contexto se crea con embedding=True solo si el perfil lo pide
+        if not self.llama_kwargs.get("embedding"):
+            raise RuntimeError(
+                "llama_cpp backend loaded without embeddings; "
+                'set "embedding": true in runtime_profile.json'
+            )
+        return self.llm.embed(text)
@@ -0,0 +1,80 @@
+# llm/backends/server.py
+import json
+import urllib.request
+from typing import Iterator
+
+DEFAULT_URL = "http://127.0.0.1:8080"
+
+
+class ServerBackend:
+    """
+    Motor fuera de proceso: un llama-server local (llama.cpp) con API
+    compatible con OpenAI. Permite usar otro runtime u otra máquina sin
+    cargar el modelo en la app.
+    """
+
+    name = "server"
+
+    def __init__(self, base_url: str = DEFAULT_URL, timeout: float = 600.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.context_tokens: int | None = None
+        models = self._get("/v1/models").get("data") or [{}]
+        self.model_id = models[0].get("id", "server")
+
+    def _request(self, path: str, body: dict | None = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def _get(self, path: str) -> dict:
+        with self._request(path) as resp:
+            return json.load(resp)
+
+    def _post(self, path: str, body: dict) -> dict:
+        with self._request(path, body) as resp:
+            return json.load(resp)
+
+    def _body(self, messages: list[dict], kw: dict, stream: bool) -> dict:
+        body = {"messages": messages, "stream": stream}
+        for key in ("temperature", "top_p", "max_tokens", "grammar"):
+            if kw.get(key) is not None:
+                body[key] = kw[key]
+        return body
+
+    def complete(self, messages: list[dict], **kw) -> str:
+        out = self._post("/v1/chat/completions", self._body(messages, kw, False))
+        usage = out.get("usage") or {}
+        self.context_tokens = usage.get("total_tokens")
+        return out["choices"][0]["message"]["content"].strip()
+
+    def stream(self, messages: list[dict], **kw) -> Iterator[str]:
+        self.context_tokens = None
+        # Respuesta SSE: líneas "data: {...}" y "data: [DONE]" al final
+        with self._request("/v1/chat/completions", self._body(messages, kw, True)) as resp:
+            for raw in resp:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    self.context_tokens = chunk["usage"].get("total_tokens")
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    def tokenize(self, text: str) -> list[int]:
+        return self._post("/tokenize", {"content": text})["tokens"]
+
+    def embed(self, text: str) -> list[float]:
+        out = self._post("/v1/embeddings", {"input": text})
+        return out["data"][0]["embedding"]
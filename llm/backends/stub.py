@@ -0,0 +1,78 @@
+# llm/backends/stub.py
+import hashlib
+import json
+import time
+from typing import Iterator
+
+_CHAT_REPLY = (
+    "I understand. Rest, drink plenty of fluids and keep track of your "
+    "symptoms. If they get worse or new symptoms appear, please contact "
+    "a healthcare professional."
+)
+_EMERGENCY_MESSAGE = (
+    "Some of your symptoms can be early signs of a stroke. Sit down, "
+    "do not eat or drink, note the time symptoms started and seek "
+    "urgent medical attention."
+)
+_TREATMENT = {
+    "kind": "medication", "name": "Medication", "every_hours": 8,
+    "times": [], "weekdays": [], "date": None, "days": 7, "until": None,
+}
+_EMBED_DIM = 64
+
+
+class StubBackend:
+    """
+    Motor determinista sin modelo, para tests, benchmarks y la UI.
+
+    Con prompt_tps/gen_tps simula el coste de evaluar el prompt y de
+    generar cada token a esas velocidades (tokens/s); sin ellas responde
+    al instante. Con grammar devuelve un JSON válido para ella (emergencia
+    o tratamiento).
+    """
+
+    name = "stub"
+    model_id = "stub"
+
+    def __init__(self, prompt_tps: float | None = None, gen_tps: float | None = None):
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self.context_tokens = 0
+
+    def _reply(self, grammar: str | None) -> str:
+        if not grammar:
+            return _CHAT_REPLY
+        if '\\"kind\\"' in grammar:
+            return json.dumps(_TREATMENT)
+        # Respeta un nivel fijado por la gramática de emergencia
+        level = next((lv for lv in ("red", "yellow", "green")
+                      if f'\\"{lv}\\"' in grammar), "yellow")
+        return json.dumps({"level": level, "message": _EMERGENCY_MESSAGE})
+
+    def stream(self, messages: list[dict], max_tokens: int | None = None,
+               grammar: str | None = None, **kw) -> Iterator[str]:
+        n_prompt = sum(len(self.tokenize(m["content"])) for m in messages)
+        reply = self._reply(grammar)
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)][: max_tokens or None]
+
+        if self.prompt_tps:
+            time.sleep(n_prompt / self.prompt_tps)
+        self.context_tokens = n_prompt
+        for piece in pieces:
+            if self.gen_tps:
+                time.sleep(1 / self.gen_tps)
+            self.context_tokens += 1
+            yield piece
+
+    def complete(self, messages: list[dict], **kw) -> str:
+        return "".join(self.stream(messages, **kw)).strip()
+
+    def tokenize(self, text: str) -> list[int]:
+        # ~4 bytes por token, como el tokenizador real en inglés
+        data = text.encode("utf-8")
+        return [int.from_bytes(data[i:i + 4].ljust(4, b"\0"), "little")
+                for i in range(0, len(data), 4)]
+
+    def embed(self, text: str) -> list[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest() * 2
+        return [(b - 128) / 128 for b in digest[:_EMBED_DIM]]
@@ -0,0 +1,103 @@
+# llm/backends/worker.py
+import threading
+from typing import Iterator
+
+from ..worker import connect_worker
+
+
+class WorkerBackend:
+    """
+    Motor en el proceso de inferencia compartido (ver llm.worker).
+
+    El modelo vive fuera del proceso de la UI: aquí solo se envían
+    peticiones y se reciben deltas. Cada llamada usa una conexión libre
+    del pool, así un tokenize no espera a que acabe un stream.
+    """
+
+    name = "worker"
+
+    def __init__(self, spawn: bool = True):
+        self._spawn = spawn
+        self._lock = threading.Lock()
+        self._idle: list = []
+        self.context_tokens: int | None = None
+        # Bloquea hasta que el worker tenga el modelo cargado
+        info = self._request({"op": "info"})
+        self.model_id = info["model_id"]
+        self.engine = info["name"]
+        self.worker_pid = info["pid"]
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect_worker(spawn=self._spawn)
+
+    def _release(self, conn) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    @staticmethod
+    def _result(msg: dict):
+        if "error" in msg:
+            raise RuntimeError(f"inference worker: {msg['error']}")
+        return msg.get("result")
+
+    def _request(self, req: dict):
+        conn = self._acquire()
+        try:
+            conn.send(req)
+            msg = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        self._release(conn)
+        return self._result(msg)
+
+    def complete(self, messages: list[dict], **kw) -> str:
+        out = self._request({"op": "complete", "messages": messages, "kw": kw})
+        self.context_tokens = out["context_tokens"]
+        return out["text"]
+
+    def stream(self, messages: list[dict], **kw) -> Iterator[str]:
+        self.context_tokens = None
+        conn = self._acquire()
+        done = False
+        try:
+            conn.send({"op": "stream", "messages": messages, "kw": kw})
+            while True:
+                msg = conn.recv()
+                if "delta" in msg:
+                    yield msg["delta"]
+                    continue
+                done = True
+                self._result(msg)
+                self.context_tokens = msg.get("context_tokens")
+                break
+        finally:
+            if not done:
+                # Se dejó de iterar: pedir al worker que pare y vaciar
+                # los deltas pendientes para reutilizar la conexión
+                try:
+                    conn.send({"op": "cancel"})
+                    while True:
+                        msg = conn.recv()
+                        if "delta" not in msg:
+                            self.context_tokens = msg.get("context_tokens")
+                            break
+                    done = True
+                except (EOFError, OSError):
+                    pass
+            if done:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def tokenize(self, text: str) -> list[int]:
+        return self._request({"op": "tokenize", "text": text})
+
+    def kv_cache_stats(self) -> dict:
+        return self._request({"op": "stats"})
+
+    def embed(self, text: str) -> list[float]:
+        return self._request({"op": "embed", "text": text})
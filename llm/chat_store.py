@@ -0,0 +1,52 @@
+# llm/chat_store.py
+from typing import Iterator
+
+from datastore import DataStore
+
+# Mensajes que se conservan al compactar; se compacta al llegar al doble
+CHAT_LOG_MAX_MESSAGES = 1000
+
+
+class ChatStore:
+    """
+    Historial de chat sobre la tabla chat_messages del almacén SQLite.
+
+    Añadir un turno es un INSERT, cueste lo que cueste la conversación,
+    y los mensajes recientes se leen por índice desde el final. Los
+    índices son absolutos (count(), read()): al compactar se borran los
+    más antiguos sin renumerar, así el resumen del chat no se desfasa.
+    """
+
+    def __init__(self, store: DataStore, max_messages: int = CHAT_LOG_MAX_MESSAGES):
+        self.store = store
+        self.max_messages = max_messages
+
+    def count(self) -> int:
+        """Mensajes añadidos desde el principio (incluidos los compactados)."""
+        return self.store.chat_count()
+
+    def messages(self) -> list[dict]:
+        """Mensajes conservados, del más antiguo al más reciente."""
+        return self.store.chat_read(0)
+
+    def read(self, start: int, stop: int | None = None) -> list[dict]:
+        """Mensajes [start, stop) en índices absolutos (solo los conservados)."""
+        return self.store.chat_read(start, stop)
+
+    def iter_recent(self) -> Iterator[dict]:
+        """Del más reciente al más antiguo, leyendo por páginas."""
+        return self.store.chat_recent()
+
+    def append(self, *messages: dict) -> None:
+        before = self.count()
+        self.store.chat_append(messages)
+        # Compacta cada max_messages mensajes añadidos
+        if self.count() // self.max_messages != before // self.max_messages:
+            self.compact()
+
+    def compact(self) -> None:
+        """Conserva solo los max_messages mensajes más recientes."""
+        self.store.chat_compact(self.max_messages)
+
+    def clear(self) -> None:
+        self.store.chat_clear()
@@ -1,95 +1,300 @@
 # llm/gemma_wrapper.py
-import contextlib
-import os, sys
 import json
-import concurrent.futures
+import time
+import threading
 import asyncio
-from pathlib import Path
-from functools import partial
+from functools import partial, lru_cache
 
-from llama_cpp import Llama
 from text_utils import clean_emoji_text
-from .prompt_builder import build_emergency_prompt  # 👈 solo este
-
-# ──────────────────────────────────────────────────────────────
-# Modelo Gemma cargado sin imprimir logs en consola
-# ──────────────────────────────────────────────────────────────
-def _get_model_path() -> Path:
-    """
-    Devuelve la ruta al .gguf:
-     - Si estamos en un EXE --onefile, mira en sys._MEIPASS/models/…
-     - En desarrollo, mira en <project_root>/models/…
-    """
-    rel = Path("models") / "gemma3n" / "gemma-3n-2b-it-gguf" / "gemma-3n-E2B-it-Q4_K_M.gguf"
-
-    if getattr(sys, "_MEIPASS", None):
-        base = Path(sys._MEIPASS)
-    else:
-        base = Path(__file__).parent.parent
-
-    model_path = base / rel
-    if not model_path.exists():
-        raise FileNotFoundError(
-            f"Gemma model not found at {model_path!r}\n"
-            "  • En local, asegúrate de tener ./models/gemma3n/gemma-3n-2b-it-gguf/…\n"
-            "  • En EXE, compílalo con --add-data \"models;models\""
-        )
-    return model_path
-
-# ──────────────────────────────────────────────────────────────
-# Cargamos el modelo sin imprimir logs en consola
-# ──────────────────────────────────────────────────────────────
-_fnull = open(os.devnull, 'w')
-with contextlib.redirect_stdout(_fnull), contextlib.redirect_stderr(_fnull):
-    MODEL_PATH = _get_model_path()
-    llm = Llama(
-        model_path=str(MODEL_PATH),
-        n_ctx=1024,
-        n_threads=max(os.cpu_count() // 2, 2),
-        chat_format="gemma",
-        low_vram=True,
-        verbose=False,
+from .model_manager import model_manager
+from .scheduler import (
+    scheduler, EMERGENCY, CHAT, BACKGROUND, PRIORITY_NAMES, GenerationPreempted,
+)
+from .grammars import emergency_gbnf, TREATMENT_GBNF
+from .response_cache import emergency_cache, cache_key
+from . import prompt_builder
+from .prompt_builder import (
+    CHAT_PROMPT_BUDGET,
+    build_emergency_prompt,
+    emergency_inputs,
+    build_chat_prompt,
+    build_summary_prompt,
+    build_treatment_prompt,
+    load_chat_summary,
+    save_chat_summary,
+    save_chat_turn,
+    token_counter,
+)
+
+# Límites de tokens generados (llama-cpp recorta además a lo que quede de n_ctx)
+CHAT_MAX_TOKENS      = 1000
+EMERGENCY_MAX_TOKENS = 600
+SUMMARY_MAX_TOKENS   = 200
+TREATMENT_MAX_TOKENS = 160
+
+# Resumen del historial: tras cuántos segundos sin actividad del chat se
+# lanza y cuántos tokens de mensajes nuevos entran en cada pasada
+SUMMARY_IDLE_S       = 20.0
+SUMMARY_INPUT_BUDGET = 384
+
+# Métricas de la última generación en streaming (ttft/total en segundos,
+# chunks generados, si se cortó y tokens en contexto al terminar)
+last_stream_stats: dict = {}
+
+_DONE = object()
+
+_summary_timer: asyncio.TimerHandle | None = None
+_summary_tasks: set = set()
+
+def kv_cache_stats() -> dict:
+    """Aciertos/fallos y ocupación de la caché de prefijos KV."""
+    if not model_manager.is_ready:
+        return {}
+    # En proceso o en el worker compartido (op "stats"); otros motores: {}
+    stats = getattr(model_manager.get(), "kv_cache_stats", None)
+    return stats() if stats is not None else {}
+
+@lru_cache(maxsize=None)
+def _token_counter(backend):
+    """Contador de tokens memorizado del backend cargado."""
+    return token_counter(backend.tokenize)
+
+async def _chat_request(user_text: str) -> tuple[list[dict], int]:
+    """
+    Prompt de chat recortado con el tokenizador del modelo al presupuesto
+    del perfil, y max_tokens limitado a lo que queda de contexto.
+    """
+    backend = await model_manager.wait_ready()
+    profile = model_manager.profile or {}
+    budget = profile.get("chat_prompt_budget", CHAT_PROMPT_BUDGET)
+    n_ctx = profile.get("n_ctx")
+    max_tokens = min(CHAT_MAX_TOKENS, n_ctx - budget) if n_ctx else CHAT_MAX_TOKENS
+    messages = await asyncio.to_thread(
+        build_chat_prompt, user_text, _token_counter(backend), budget
     )
-# ──────────────────────────────────────────────────────────────
+    return messages, max_tokens
 
-_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+def _stream(messages, on_delta, cancel: threading.Event, **kw) -> dict:
+    """
+    Genera con stream=True y entrega cada delta de texto a on_delta.
+    Se corta en cuanto `cancel` está activo (parada del usuario o
+    desalojo por una tarea más prioritaria). Devuelve las métricas.
+    """
+    # Se ejecuta en el hilo del scheduler: espera aquí a que cargue el modelo
+    backend = model_manager.get()
+    start = time.perf_counter()
+    stats = {"ttft": None, "total": None, "chunks": 0, "cut": False}
+    deltas = backend.stream(messages, **kw)
+    for delta in deltas:
+        if cancel.is_set():
+            # Cortada antes de terminar (el scheduler lo usa para saber
+            # si un desalojo llegó a tiempo de interrumpirla)
+            stats["cut"] = True
+            break
+        if stats["ttft"] is None:
+            stats["ttft"] = time.perf_counter() - start
+        stats["chunks"] += 1
+        on_delta(delta)
+    deltas.close()
+    stats["total"] = time.perf_counter() - start
+    # Tokens en contexto al terminar (prompt + generados)
+    stats["context_tokens"] = backend.context_tokens
+    return stats
 
-def _call(messages, **kw):
-    out = llm.create_chat_completion(messages=messages, **kw)
-    return out["choices"][0]["message"]["content"].strip()
+def _call(messages, cancel: threading.Event, **kw) -> dict:
+    parts: list[str] = []
+    stats = _stream(messages, parts.append, cancel, **kw)
+    stats["text"] = "".join(parts).strip()
+    return stats
 
-async def medichat_async(user_text: str):
-    # import local para evitar ciclos
-    from .prompt_builder import build_chat_prompt
+async def _run(messages, priority: int, **kw) -> str:
+    """Generación completa encolada en el scheduler con la prioridad dada."""
+    cancel = threading.Event()
+    fut = scheduler.submit(partial(_call, messages, cancel, **kw), priority, cancel)
+    return (await asyncio.wrap_future(fut))["text"]
 
-    messages, chat_file = build_chat_prompt(user_text)
+def _log_stream(priority: int, stats: dict) -> None:
+    ttft = stats["ttft"]
+    print(f"[gemma] {PRIORITY_NAMES[priority]}: "
+          f"ttft {'n/a' if ttft is None else f'{ttft:.2f} s'}, "
+          f"{stats['chunks']} chunks in {stats['total']:.2f} s"
+          f"{' (cut)' if stats['cut'] else ''}")
 
-    fn   = partial(_call, messages, temperature=0.8, top_p=0.9, max_tokens=1000)
-    loop = asyncio.get_event_loop()
-    reply = await loop.run_in_executor(_executor, fn)
+async def _astream(messages, priority: int, cancel: threading.Event | None = None, **kw):
+    """
+    Puente entre el generador de llama-cpp (hilo del scheduler) y el loop
+    de asyncio. Cerrar el generador asíncrono cancela la generación; si
+    la desaloja una tarea más urgente se lanza GenerationPreempted.
+    """
+    cancel = cancel or threading.Event()
+    loop   = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
 
-    cleaned_reply = clean_emoji_text(reply)
-    messages.append({"role": "assistant", "content": cleaned_reply})
+    def push(delta: str):
+        loop.call_soon_threadsafe(queue.put_nowait, delta)
 
-    chat_file.write_text(
-        json.dumps(messages, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-        errors="ignore",
+    fut = asyncio.wrap_future(
+        scheduler.submit(partial(_stream, messages, push, cancel, **kw), priority, cancel)
     )
-    return cleaned_reply
+    fut.add_done_callback(lambda _: queue.put_nowait(_DONE))
+    try:
+        while (item := await queue.get()) is not _DONE:
+            yield item
+        last_stream_stats.clear()
+        last_stream_stats.update(fut.result())
+        _log_stream(priority, last_stream_stats)
+    finally:
+        cancel.set()
 
-async def emergency_async(extra_user_message: str = ""):
-    sys_msgs = build_emergency_prompt()
-    if extra_user_message:
-        sys_msgs.append({"role": "user", "content": extra_user_message})
+async def medichat_stream_async(user_text: str, cancel: threading.Event | None = None):
+    """
+    Respuesta de Medichat: va entregando los deltas según llegan. Al
+    terminar guarda el turno en el historial.
+    """
+    _cancel_summary()
+    messages, max_tokens = await _chat_request(user_text)
+
+    parts: list[str] = []
+    async for delta in _astream(
+        messages, CHAT, cancel,
+        temperature=0.8, top_p=0.9, max_tokens=max_tokens,
+    ):
+        delta = clean_emoji_text(delta)
+        parts.append(delta)
+        yield delta
+
+    save_chat_turn(user_text, "".join(parts).strip())
+    _schedule_summary()
+
+# ─── Resumen del historial en segundo plano ───────────────────
+def _cancel_summary() -> None:
+    """Un mensaje nuevo aplaza el resumen (la generación en curso ya la
+    desaloja el scheduler al entrar la de chat)."""
+    global _summary_timer
+    if _summary_timer is not None:
+        _summary_timer.cancel()
+        _summary_timer = None
 
-    fn = partial(
-        _call,
-        sys_msgs,
+def _schedule_summary() -> None:
+    """Resume el historial cuando el chat lleve SUMMARY_IDLE_S inactivo."""
+    global _summary_timer
+    _cancel_summary()
+
+    def start():
+        task = asyncio.ensure_future(summarize_history_async())
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+
+    _summary_timer = asyncio.get_running_loop().call_later(SUMMARY_IDLE_S, start)
+
+async def summarize_history_async() -> bool:
+    """
+    Incorpora al resumen acumulado los mensajes que ya quedaron fuera del
+    prompt de chat (según el último build_chat_prompt), por tandas de
+    SUMMARY_INPUT_BUDGET tokens, con prioridad BACKGROUND. Si llega una
+    petición de chat o emergencia se abandona y se reintenta en la
+    siguiente pausa. Devuelve True si el resumen quedó al día.
+    """
+    backend = await model_manager.wait_ready()
+    count = _token_counter(backend)
+    while True:
+        summary, covered = load_chat_summary()
+        upto = prompt_builder.last_prompt_stats.get("dropped_messages", 0)
+        pending = prompt_builder.chat_store.read(covered, upto)
+        if not pending:
+            return True
+
+        batch, used = [], 0
+        for msg in pending:
+            cost = count(msg["content"])
+            if batch and used + cost > SUMMARY_INPUT_BUDGET:
+                break
+            batch.append(msg)
+            used += cost
+        try:
+            text = await _run(
+                build_summary_prompt(summary, batch), BACKGROUND,
+                temperature=0.2, top_p=0.9, max_tokens=SUMMARY_MAX_TOKENS,
+            )
+        except GenerationPreempted:
+            return False
+        if not text:
+            return False
+        save_chat_summary(text, covered + len(batch))
+
+async def _emergency_request(payload: dict, extra_user_message: str, level: str | None):
+    """
+    Prompt y parámetros de una evaluación de emergencia, y su clave en la
+    caché de respuestas: prompt (ya normalizado y sin hora) + modelo +
+    parámetros de muestreo. Sale del payload de la vista, no del almacén
+    (que puede ir por detrás o tener otra forma).
+    """
+    messages = build_emergency_prompt(emergency_inputs(payload))
+    if extra_user_message:
+        messages.append({"role": "user", "content": extra_user_message})
+    kw = dict(
         temperature=0.25,
         top_p=0.5,
-        max_tokens=600,              # ⬆ más tokens
+        max_tokens=EMERGENCY_MAX_TOKENS,
+        grammar=emergency_gbnf(level),
     )
-    loop = asyncio.get_event_loop()
-    reply = await loop.run_in_executor(_executor, fn)
-    return clean_emoji_text(reply)
+    backend = await model_manager.wait_ready()
+    key = cache_key(messages=messages, model=backend.model_id, sampling=kw)
+    return messages, kw, key
+
+def _is_complete(reply: str) -> bool:
+    """¿Es un JSON {"level","message"} completo? (no cortado ni parado)"""
+    try:
+        data = json.loads(reply)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and "level" in data and "message" in data
+
+async def emergency_stream_async(
+    payload: dict,
+    extra_user_message: str = "",
+    cancel: threading.Event | None = None,
+    level: str | None = None,
+):
+    """
+    Generación de emergencia en streaming; entrega los deltas según llegan.
+    Va por delante de cualquier generación de chat en curso o en cola.
+    La salida está restringida por gramática al JSON {"level","message"}
+    (con `level` fijado si se indica) y termina al cerrar el objeto.
+    Si la misma evaluación ya está en caché se entrega de una vez.
+    """
+    messages, kw, key = await _emergency_request(payload, extra_user_message, level)
+    cached = emergency_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts: list[str] = []
+    async for delta in _astream(messages, EMERGENCY, cancel, **kw):
+        parts.append(delta)
+        yield delta
+
+    reply = "".join(parts).strip()
+    if _is_complete(reply):
+        emergency_cache.put(key, reply)
+
+async def parse_treatment_async(text: str, today: str) -> dict | None:
+    """
+    Interpreta un tratamiento o cita en texto libre con la gramática
+    TREATMENT_GBNF (ver treatment_parser, que solo llega aquí cuando
+    sus reglas no lo reconocen). None si la salida no es JSON completo
+    o si una emergencia desaloja la generación.
+    """
+    try:
+        reply = await _run(
+            build_treatment_prompt(text, today), CHAT,
+            temperature=0.0, top_p=1.0, max_tokens=TREATMENT_MAX_TOKENS,
+            grammar=TREATMENT_GBNF,
+        )
+    except GenerationPreempted:
+        return None
+    try:
+        data = json.loads(reply)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
@@ -0,0 +1,53 @@
+# llm/grammars.py
+# ──────────────────────────────────────────────────────────────
+# GBNF para la salida de emergencia:
+#   { "level": "green|yellow|red", "message": "<texto>" }
+# La gramática termina al cerrar el objeto, así que la generación se
+# detiene ahí y la salida siempre es JSON válido. Los backends reciben el
+# texto GBNF (llama-cpp lo compila con LlamaGrammar).
+# ──────────────────────────────────────────────────────────────
+_EMERGENCY_GBNF = r'''
+root    ::= "{" ws "\"level\"" ws ":" ws level ws "," ws "\"message\"" ws ":" ws string ws "}"
+level   ::= {levels}
+string  ::= "\"" char* "\""
+char    ::= [^"\\\x7F\x00-\x1F] | "\\" (["\\/bfnrt] | "u" hex hex hex hex)
+hex     ::= [0-9a-fA-F]
+ws      ::= [ \t\n]?
+'''
+
+LEVELS = ("green", "yellow", "red")
+
+
+def emergency_gbnf(level: str | None = None) -> str:
+    """
+    Texto GBNF del esquema de emergencia. Con `level` el campo queda
+    fijado a ese valor (el calculado por reglas).
+    """
+    levels = (level,) if level in LEVELS else LEVELS
+    alts = " | ".join(f'"\\"{lv}\\""' for lv in levels)
+    return _EMERGENCY_GBNF.replace("{levels}", alts)
+
+
+
+# ──────────────────────────────────────────────────────────────
+# GBNF para interpretar un tratamiento o cita en texto libre
+# (respaldo de treatment_parser cuando ninguna regla encaja):
+#   { "kind": "medication|appointment", "name": "...",
+#     "every_hours": n|null, "times": ["HH:MM", ...],
+#     "weekdays": ["mon", ...], "date": "YYYY-MM-DD"|null,
+#     "days": n|null, "until": "YYYY-MM-DD"|null }
+# ──────────────────────────────────────────────────────────────
+TREATMENT_GBNF = r'''
+root     ::= "{" ws "\"kind\"" ws ":" ws kind ws "," ws "\"name\"" ws ":" ws string ws "," ws "\"every_hours\"" ws ":" ws (number | "null") ws "," ws "\"times\"" ws ":" ws times ws "," ws "\"weekdays\"" ws ":" ws weekdays ws "," ws "\"date\"" ws ":" ws (date | "null") ws "," ws "\"days\"" ws ":" ws (int | "null") ws "," ws "\"until\"" ws ":" ws (date | "null") ws "}"
+kind     ::= "\"medication\"" | "\"appointment\""
+times    ::= "[" ws ( time ( ws "," ws time )* )? ws "]"
+time     ::= "\"" [0-2] [0-9] ":" [0-5] [0-9] "\""
+weekdays ::= "[" ws ( weekday ( ws "," ws weekday )* )? ws "]"
+weekday  ::= "\"" ("mon" | "tue" | "wed" | "thu" | "fri" | "sat" | "sun") "\""
+date     ::= "\"" [0-9] [0-9] [0-9] [0-9] "-" [0-1] [0-9] "-" [0-3] [0-9] "\""
+number   ::= int ("." [0-9]+)?
+int      ::= [1-9] [0-9]{0,3}
+string   ::= "\"" char{1,80} "\""
+char     ::= [^"\\\x7F\x00-\x1F]
+ws       ::= [ \t\n]?
+'''
@@ -0,0 +1,122 @@
+# llm/kv_cache.py
+import os
+import pickle
+from pathlib import Path
+
+from llama_cpp import Llama, LlamaRAMCache
+
+# ─── Instantáneas de calentamiento en APPDATA ──────────────────
+APPDATA_DIR = Path(
+    os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
+) / "GemiASD"
+APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+
+KV_SNAPSHOT_DIR = APPDATA_DIR / "kv_warmup"
+
+# Memoria máxima para estados KV guardados (LRU al superarla)
+KV_CACHE_BYTES = 512 << 20
+
+# Prefijo común mínimo para reutilizar un estado de la LRU: todos los
+# prompts empiezan por BOS + "<start_of_turn>user\n", y restaurar un
+# estado para ahorrar esos pocos tokens no compensa (ni es un acierto)
+MIN_REUSE_TOKENS = 16
+
+
+class PrefixCache(LlamaRAMCache):
+    """
+    Caché de estados KV indexada por prefijo de tokens.
+
+    llama-cpp guarda aquí el estado tras cada generación (prompt + respuesta)
+    y, en la siguiente llamada, restaura el de prefijo común más largo, de
+    modo que solo se evalúan los tokens nuevos (el último turno del usuario).
+    Añade contadores de aciertos/fallos/expulsiones sobre LlamaRAMCache.
+
+    Los estados fijados con pin() (prompts de sistema precalculados al
+    cargar el modelo) no cuentan para la capacidad ni se expulsan, y solo
+    se sirven a prompts que contienen el prefijo fijado entero. Un prompt
+    de otro tipo (resumen, tratamiento) cuenta como fallo.
+    """
+
+    def __init__(self, capacity_bytes: int = KV_CACHE_BYTES):
+        super().__init__(capacity_bytes=capacity_bytes)
+        self.pinned: dict[tuple, object] = {}
+        self.hits = 0
+        self.pinned_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def pin(self, key, state) -> None:
+        self.pinned[tuple(key)] = state
+
+    def _longest_pinned(self, key: tuple) -> tuple | None:
+        """El prefijo fijado más largo que `key` contiene entero."""
+        best = None
+        for pinned_key in self.pinned:
+            if (len(pinned_key) <= len(key) and key[:len(pinned_key)] == pinned_key
+                    and (best is None or len(pinned_key) > len(best))):
+                best = pinned_key
+        return best
+
+    def _lru_len(self, key: tuple) -> int:
+        lru_key = self._find_longest_prefix_key(key)
+        n = Llama.longest_token_prefix(lru_key, key) if lru_key is not None else 0
+        return n if n >= MIN_REUSE_TOKENS else 0
+
+    def __getitem__(self, key):
+        key = tuple(key)
+        pinned_key = self._longest_pinned(key)
+        lru_len = self._lru_len(key)
+        if pinned_key is not None and len(pinned_key) >= lru_len:
+            self.hits += 1
+            self.pinned_hits += 1
+            return self.pinned[pinned_key]
+        if not lru_len:
+            self.misses += 1
+            raise KeyError("no reusable prefix")
+        self.hits += 1
+        return super().__getitem__(key)
+
+    def __contains__(self, key) -> bool:
+        key = tuple(key)
+        return self._lru_len(key) > 0 or self._longest_pinned(key) is not None
+
+    def __setitem__(self, key, value) -> None:
+        before = len(self.cache_state) + (0 if tuple(key) in self.cache_state else 1)
+        super().__setitem__(key, value)
+        self.evictions += before - len(self.cache_state)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "pinned_hits": self.pinned_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache_state),
+            "pinned": len(self.pinned),
+            "bytes": self.cache_size,
+            "capacity_bytes": self.capacity_bytes,
+        }
+
+
+def save_snapshot(path: Path, state) -> None:
+    """
+    Guarda un estado KV en disco (pickle de LlamaState, como hace
+    LlamaDiskCache de llama-cpp).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: Path):
+    """
+    Estado guardado con save_snapshot(), o None si no existe o no se
+    puede leer (p. ej. de otra versión de llama-cpp).
+    """
+    try:
+        with open(path, "rb") as fh:
+            return pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
@@ -0,0 +1,109 @@
+# llm/model_manager.py
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+
+def warm_up(backend, profile: dict) -> float | None:
+    """
+    Precalcula el KV de los prompts de sistema fijos si el backend lo
+    admite (en proceso; el worker lo hace en su propio proceso). Se
+    llama antes de marcar el modelo como listo, sin generaciones en
+    curso. Devuelve los segundos empleados.
+    """
+    fn = getattr(backend, "warm_up", None)
+    if fn is None:
+        return None
+    from .kv_cache import KV_SNAPSHOT_DIR
+    from .prompt_builder import warmup_prompts
+
+    t0 = time.perf_counter()
+    fn(warmup_prompts(), KV_SNAPSHOT_DIR if profile.get("persist_warmup") else None)
+    return time.perf_counter() - t0
+
+
+class ModelManager:
+    """
+    Carga perezosa del motor de inferencia en un hilo de fondo.
+
+    start() lanza la carga (idempotente) y devuelve el future de
+    disponibilidad; get() bloquea hasta tener el backend listo
+    (ver llm.backends) y wait_ready() es su equivalente para asyncio.
+    Tras cargar, se precalculan los prompts de sistema (warm_up()).
+    Estados: "idle" → "loading" → "ready" | "error".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._future: concurrent.futures.Future = concurrent.futures.Future()
+        self._thread: threading.Thread | None = None
+        self.state = "idle"
+        self.load_seconds: float | None = None
+        self.warmup_seconds: float | None = None
+        self.profile: dict | None = None
+
+    @property
+    def ready(self) -> concurrent.futures.Future:
+        return self._future
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> concurrent.futures.Future:
+        with self._lock:
+            if self._thread is None and not self._future.done():
+                self.state = "loading"
+                self._thread = threading.Thread(
+                    target=self._load, name="gemma-loader", daemon=True
+                )
+                self._thread.start()
+        return self._future
+
+    def get(self, timeout: float | None = None):
+        return self.start().result(timeout)
+
+    async def wait_ready(self):
+        return await asyncio.wrap_future(self.start())
+
+    def install(self, backend) -> None:
+        """
+        Usa un backend ya construido (p. ej. el stub en benchmarks) en
+        lugar del configurado. Debe llamarse antes de start().
+        """
+        with self._lock:
+            if self._thread is not None or self._future.done():
+                raise RuntimeError("model already loading or loaded")
+            self.load_seconds = 0.0
+            self.state = "ready"
+            self._future.set_result(backend)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "profile": self.profile,
+        }
+
+    def _load(self):
+        t0 = time.perf_counter()
+        try:
+            from .backends import create_backend
+            from .runtime_profile import load_profile
+
+            self.profile = load_profile()
+            backend = create_backend(self.profile)
+            self.warmup_seconds = warm_up(backend, self.profile)
+        except BaseException as ex:
+            self.state = "error"
+            self._future.set_exception(ex)
+            return
+        self.load_seconds = time.perf_counter() - t0
+        self.state = "ready"
+        print(f"[model_manager] {backend.name} ready in {self.load_seconds:.1f} s")
+        self._future.set_result(backend)
+
+
+model_manager = ModelManager()
@@ -1,19 +1,23 @@
 # llm/prompt_builder.py
-import json
-import os
-import datetime
-from pathlib import Path
+from functools import lru_cache
+from typing import Callable
 from text_utils import clean_emoji_text
+from datastore import store, CHAT_DOC
+from .chat_store import ChatStore
 
-# 1) Definir APPDATA\GemiASD
-APPDATA_DIR = Path(
-    os.getenv("APPDATA", Path.home()/"AppData"/"Roaming")
-) / "GemiASD"
-APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+# Datos del usuario y del chat en el almacén SQLite (ver datastore);
+# los benchmarks sustituyen ambos por un almacén temporal
+chat_store = ChatStore(store)
 
-# 2) Usar esa carpeta directamente
-PROFILE   = APPDATA_DIR / "gemi_user_data.json"
-CHAT_FILE = APPDATA_DIR / "chat_data.json"
+# Presupuesto de tokens del prompt de chat (sistema + historial + mensaje).
+# Con n_ctx=1024 deja al menos la mitad del contexto para la respuesta.
+# Es el valor por defecto: el real viene del perfil ("chat_prompt_budget").
+CHAT_PROMPT_BUDGET   = 512
+TURN_OVERHEAD_TOKENS = 4
+
+# Resultado del último build_chat_prompt: tokens usados, presupuesto y
+# mensajes/turnos del historial que quedaron fuera
+last_prompt_stats: dict = {}
 
 # Prompt genérico para chat
 SYSTEM_PROMPT = (
@@ -21,63 +25,229 @@ SYSTEM_PROMPT = (
     "Respond in a clear, professional, and concise manner."
 )
 
+# Resumen acumulado de los turnos que ya no caben en el prompt de chat
+SUMMARY_PROMPT = (
+    "You keep a running summary of a conversation between a user and "
+    "Gemi, a medical assistant. Keep what matters for later answers: "
+    "symptoms, conditions, medications, allergies and advice given. "
+    "Reply with the updated summary only, in at most 120 words."
+)
+
+# Prompt fijo de emergencia (respuesta JSON con nivel y mensaje)
+EMERGENCY_SYSTEM_PROMPT = (
+    "You are Gemi ADS, an OFF-LINE first aid assistant.\n"
+    "ALWAYS return a JSON object with no extra text.\n"
+    "Format:\n"
+    '{ "level": "green|yellow|red", "message": "<brief recommendations>" }'
+)
+
+# Interpretar un tratamiento o cita escrito en texto libre (la salida
+# está restringida por llm.grammars.TREATMENT_GBNF)
+TREATMENT_PARSE_PROMPT = (
+    "You turn a medication or appointment request into JSON for a "
+    "calendar. name: the medicine (with dose) or the appointment. "
+    "every_hours: hours between doses, or null. times: fixed clock "
+    "times (24h HH:MM), or []. weekdays: only for weekly schedules, "
+    "or []. date: first day, or the appointment day (YYYY-MM-DD), or "
+    "null for today. days: treatment length in days, or null. until: "
+    "last day (YYYY-MM-DD), or null. Return only the JSON object."
+)
+
 
-def _load(path: Path, default):
-    if not path.exists():
-        return default
-    txt = path.read_text(encoding="utf-8").strip()
-    return json.loads(txt) if txt else default
+def _checked(items) -> list[str]:
+    # Lista de claves o dict {clave: marcada} (como en app_state)
+    if isinstance(items, dict):
+        items = [k for k, v in items.items() if v]
+    return sorted(set(items or []))
 
 
-def build_emergency_prompt() -> list[dict]:
+def emergency_inputs(payload: dict) -> dict:
     """
-    Genera el prompt de emergencia (objetos JSON con nivel y mensaje).
-    Conservamos esta función para el flujo de primeros auxilios.
+    Datos de la evaluación que determinan el prompt de emergencia,
+    normalizados (solo lo marcado, ordenado y sin duplicados) para que la
+    misma combinación de síntomas produzca siempre el mismo prompt.
     """
-    data = _load(PROFILE, {})
-    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    profile = payload.get("profile", {})
+    return {
+        "gender":     profile.get("gender") or "?",
+        "age":        profile.get("age", "?"),
+        "background": _checked(payload.get("background")),
+        "symptoms":   _checked(payload.get("symptoms")),
+    }
 
-    profile      = data.get("profile", {})
-    gender       = profile.get("gender", "?")
-    age          = profile.get("age", "?")
-    background = ", ".join(data.get("background", [])) or "None"
-    symptoms     = ", ".join(data.get("symptoms", []))     or "No symptoms"
 
-    system_msg = (
-        "You are Gemi ADS, an OFF-LINE first aid assistant.\n"
-        "ALWAYS return a JSON object with no extra text.\n"
-        "Format:\n"
-        '{ "level": "green|yellow|red", "message": "<brief recommendations>" }'
-    )
+def build_emergency_prompt(inputs: dict) -> list[dict]:
+    """
+    Genera el prompt de emergencia (objetos JSON con nivel y mensaje) a
+    partir de emergency_inputs(payload). El prompt no lleva hora: solo
+    depende de `inputs`, así las respuestas se pueden cachear (ver
+    llm.response_cache).
+    """
+    background = ", ".join(inputs["background"]) or "None"
+    symptoms   = ", ".join(inputs["symptoms"])   or "No symptoms"
 
     user_msg = (
         "Evaluate the risk of stroke with this information.\n"
-        f"Profile: {gender}, {age} years old\n"
+        f"Profile: {inputs['gender']}, {inputs['age']} years old\n"
         f"Background: {background}\n"
-        f"Current symptoms ({ts}): {symptoms}"
+        f"Current symptoms: {symptoms}"
     )
 
     return [
-        {"role": "system",  "content": clean_emoji_text(system_msg)},
+        {"role": "system",  "content": clean_emoji_text(EMERGENCY_SYSTEM_PROMPT)},
         {"role": "user",    "content": clean_emoji_text(user_msg)},
     ]
 
 
-def build_chat_prompt(user_msg: str) -> tuple[list[dict], Path]:
+def warmup_prompts() -> list[list[dict]]:
+    """
+    Mensajes de sistema fijos (chat y emergencia) cuyo estado KV se
+    precalcula al cargar el modelo (ver ModelManager).
+    """
+    return [
+        [{"role": "system", "content": clean_emoji_text(SYSTEM_PROMPT)}],
+        [{"role": "system", "content": clean_emoji_text(EMERGENCY_SYSTEM_PROMPT)}],
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación conservadora de tokens (~3 caracteres por token) más el
+    coste fijo de las marcas de turno del formato de chat.
+    """
+    return len(text) // 3 + TURN_OVERHEAD_TOKENS
+
+
+def token_counter(tokenize: Callable[[str], list[int]], maxsize: int = 4096) -> Callable[[str], int]:
+    """
+    Contador exacto con el tokenizador del modelo, memorizado por texto:
+    cada mensaje del historial se tokeniza una sola vez. Incluye el coste
+    de las marcas de turno, como estimate_tokens.
     """
-    Always build a chat prompt with:
+    @lru_cache(maxsize=maxsize)
+    def count(text: str) -> int:
+        return len(tokenize(text)) + TURN_OVERHEAD_TOKENS
+    return count
+
+
+def load_chat_history() -> list[dict]:
+    """
+    Historial persistido (solo turnos user/assistant), la única fuente
+    de verdad de la conversación.
+    """
+    return chat_store.messages()
+
+
+def save_chat_turn(user_msg: str, reply: str) -> None:
+    """
+    Añade al historial persistido el mensaje del usuario y la respuesta
+    (dos líneas al final del log, sin reescribirlo).
+    """
+    chat_store.append(
+        {"role": "user", "content": clean_emoji_text(user_msg)},
+        {"role": "assistant", "content": clean_emoji_text(reply)},
+    )
+
+
+def load_chat_summary() -> tuple[str, int]:
+    """
+    Resumen acumulado y cuántos mensajes del historial cubre. Si el
+    historial es más corto (se borró el chat) el resumen no vale.
+    """
+    summary = store.get_value(CHAT_DOC, "summary", "")
+    covered = store.get_value(CHAT_DOC, "covered", 0)
+    if not summary or covered > chat_store.count():
+        return "", 0
+    return summary, covered
+
+
+def save_chat_summary(summary: str, covered: int) -> None:
+    store.update_document(CHAT_DOC, {"summary": clean_emoji_text(summary), "covered": covered})
+
+
+def build_summary_prompt(summary: str, messages: list[dict]) -> list[dict]:
+    """
+    Prompt para ampliar el resumen con los mensajes que salen de la
+    ventana del chat.
+    """
+    names = {"user": "User", "assistant": "Gemi"}
+    lines = "\n".join(f"{names[m['role']]}: {m['content']}" for m in messages)
+    user_msg = (
+        f"Current summary:\n{summary or 'None'}\n\n"
+        f"New messages:\n{lines}"
+    )
+    return [
+        {"role": "system", "content": clean_emoji_text(SUMMARY_PROMPT)},
+        {"role": "user", "content": clean_emoji_text(user_msg)},
+    ]
+
+
+def build_treatment_prompt(text: str, today: str) -> list[dict]:
+    """
+    Prompt para interpretar `text` como tratamiento o cita; `today`
+    (YYYY-MM-DD, día de la semana) resuelve fechas relativas.
+    """
+    user_msg = f"Today is {today}.\nRequest: {text}"
+    return [
+        {"role": "system", "content": clean_emoji_text(TREATMENT_PARSE_PROMPT)},
+        {"role": "user", "content": clean_emoji_text(user_msg)},
+    ]
+
+
+def build_chat_prompt(
+    user_msg: str,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    budget: int = CHAT_PROMPT_BUDGET,
+) -> list[dict]:
+    """
+    Build the chat prompt with:
       1) System message (SYSTEM_PROMPT)
-      2) Up to 9 previous messages (from chat_data.json)
-      3) The current user message
-
-    Returns the list of messages and the save path.
-    """
-    history = _load(CHAT_FILE, [])
-    # Mantener solo últimas 9 para no exceder tokens
-    history = history[-9:]
-    # Insertar el prompt de sistema si no está
-    if not history or history[0]["role"] != "system":
-        history.insert(0, {"role": "system", "content": clean_emoji_text(SYSTEM_PROMPT)})
-    # Añadir el mensaje nuevo del usuario
-    history.append({"role": "user", "content": clean_emoji_text(user_msg)})
-    return history, CHAT_FILE
+      2) The running summary of older turns, if any
+      3) The most recent turns from the chat log that fit in `budget`
+      4) The current user message
+
+    System prompt and current message are always included; older turns
+    are dropped first, so prompt size stays bounded however long the
+    conversation gets. `count_tokens` should be the model tokenizer
+    (see token_counter); how many turns were dropped is reported in
+    last_prompt_stats.
+    """
+    system = {"role": "system", "content": clean_emoji_text(SYSTEM_PROMPT)}
+    current = {"role": "user", "content": clean_emoji_text(user_msg)}
+    used = count_tokens(system["content"]) + count_tokens(current["content"])
+
+    head = [system]
+    summary, covered = load_chat_summary()
+    if summary:
+        note = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation: {summary}",
+        }
+        head.append(note)
+        used += count_tokens(note["content"])
+
+    total = chat_store.count()
+    kept: list[dict] = []
+    for msg in chat_store.iter_recent():
+        cost = count_tokens(msg["content"])
+        if used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    # El historial debe empezar por un turno de usuario
+    while kept and kept[-1]["role"] != "user":
+        used -= count_tokens(kept.pop()["content"])
+
+    # Índice absoluto del primer mensaje que entra (los turnos van en pares)
+    dropped = total - len(kept)
+    last_prompt_stats.clear()
+    last_prompt_stats.update({
+        "tokens": used,
+        "budget": budget,
+        "kept_messages": len(kept),
+        "dropped_messages": dropped,
+        "dropped_turns": dropped // 2,
+        "summarized_messages": covered,
+    })
+
+    return [*head, *reversed(kept), current]
@@ -0,0 +1,127 @@
+# llm/response_cache.py
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from jsonfile import load_json, save_json
+
+# ─── Caché de respuestas en APPDATA ────────────────────────────
+APPDATA_DIR = Path(
+    os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
+) / "GemiASD"
+APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+
+EMERGENCY_CACHE_FILE = APPDATA_DIR / "emergency_cache.json"
+EMERGENCY_CACHE_MAX_ENTRIES = 128
+EMERGENCY_CACHE_TTL_S = 7 * 24 * 3600
+
+# Cambiar si cambia el formato del prompt o de la respuesta
+# (2: el prompt sale del payload; las entradas de v1 pueden ser erróneas)
+_KEY_VERSION = 2
+
+
+def cache_key(**parts) -> str:
+    """
+    Clave por contenido: SHA-256 del JSON canónico de las partes
+    (prompt normalizado, id del modelo, parámetros de muestreo…).
+    """
+    canon = json.dumps(
+        {"v": _KEY_VERSION, **parts},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché persistente clave → respuesta con desalojo LRU y caducidad.
+
+    Se guarda entera en un JSON pequeño (escritura atómica, ver jsonfile)
+    al añadir entradas; el orden del fichero es el orden LRU (más antiguo
+    primero). Un acierto solo reordena en memoria: ese orden se guarda
+    con el siguiente put() o con flush() al salir.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = EMERGENCY_CACHE_MAX_ENTRIES,
+        ttl_s: float = EMERGENCY_CACHE_TTL_S,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, dict] | None = None
+        self._dirty = False
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            data = load_json(self.path)
+            if not isinstance(data, dict):
+                data = {}
+            self._entries = OrderedDict(
+                (k, v) for k, v in data.items()
+                if isinstance(v, dict) and "value" in v and "created" in v
+            )
+        return self._entries
+
+    def _save(self) -> None:
+        save_json(self._entries, self.path, indent=None)
+        self._dirty = False
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry["created"] > self.ttl_s:
+                del entries[key]
+                self._dirty = True
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self._dirty = True
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            entries = self._load()
+            entries[key] = {"value": value, "created": time.time()}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._save()
+
+    def flush(self) -> None:
+        """Guarda el orden LRU (y caducadas) pendiente de los get()."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = OrderedDict()
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._load()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+emergency_cache = ResponseCache(EMERGENCY_CACHE_FILE)
+atexit.register(emergency_cache.flush)
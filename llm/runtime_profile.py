@@ -0,0 +1,147 @@
+# llm/runtime_profile.py
+import os
+from pathlib import Path
+
+import psutil
+
+from jsonfile import load_json, save_json
+
+# ─── Ajustes por despliegue en APPDATA ─────────────────────────
+APPDATA_DIR = Path(
+    os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
+) / "GemiASD"
+APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+
+PROFILE_FILE = APPDATA_DIR / "runtime_profile.json"
+
+# Argumentos de Llama(...) configurables y su tipo
+LLAMA_KEYS = {
+    "n_ctx": int,
+    "n_batch": int,
+    "n_threads": int,
+    "n_threads_batch": int,
+    "use_mmap": bool,
+    "use_mlock": bool,
+    "flash_attn": bool,
+    "low_vram": bool,
+    "embedding": bool,   # contexto con embeddings (backend.embed); off por defecto
+}
+
+# Claves configurables: motor de inferencia + argumentos de Llama
+PROFILE_KEYS = {
+    "backend": str,        # worker | llama_cpp | stub | server (ver llm.backends)
+    "server_url": str,     # solo para backend "server"
+    "persist_warmup": bool,  # guardar en disco el KV de los prompts de sistema
+    "chat_prompt_budget": int,  # tokens de prompt de chat (sistema + historial)
+    **LLAMA_KEYS,
+}
+
+_GB = 1024 ** 3
+
+# Tokens de contexto que siempre quedan libres para la respuesta del chat
+CHAT_MIN_REPLY_TOKENS = 128
+
+# Mínimos de los ajustes numéricos (por debajo el modelo no carga o el
+# prompt de chat no cabe)
+MIN_VALUES = {
+    "n_ctx": 512,
+    "n_batch": 32,
+    "n_threads": 1,
+    "n_threads_batch": 1,
+    "chat_prompt_budget": 128,
+}
+
+
+def detect_machine() -> dict:
+    """
+    Núcleos físicos/lógicos y memoria total de la máquina.
+    """
+    logical = psutil.cpu_count(logical=True) or os.cpu_count() or 2
+    physical = psutil.cpu_count(logical=False) or max(logical // 2, 1)
+    return {
+        "physical_cores": physical,
+        "logical_cores": logical,
+        "total_memory": psutil.virtual_memory().total,
+    }
+
+
+def default_profile(machine: dict | None = None) -> dict:
+    """
+    Valores por defecto según la máquina:
+      • generación: un hilo por núcleo físico (la generación está limitada
+        por memoria; más hilos que núcleos solo compite por ellos)
+      • evaluación del prompt: todos los hilos lógicos
+      • con 16 GB o más: contexto y batch mayores
+      • prompt de chat: la mitad del contexto (el resto, para la respuesta)
+      • el modelo se carga en el proceso de inferencia compartido
+        (llm.worker), que usa llama_cpp con estos mismos argumentos
+    """
+    machine = machine or detect_machine()
+    big = machine["total_memory"] >= 16 * _GB
+    n_ctx = 2048 if big else 1024
+    return {
+        "backend": "worker",
+        "server_url": "",
+        "persist_warmup": False,
+        "chat_prompt_budget": n_ctx // 2,
+        "n_ctx": n_ctx,
+        "n_batch": 512 if big else 256,
+        "n_threads": max(machine["physical_cores"], 2),
+        "n_threads_batch": max(machine["logical_cores"], 2),
+        "use_mmap": True,
+        "use_mlock": False,
+        "flash_attn": False,
+        "low_vram": not big,
+        "embedding": False,
+    }
+
+
+def load_overrides() -> dict:
+    """
+    Ajustes guardados para este despliegue (solo claves conocidas).
+    """
+    data = load_json(PROFILE_FILE)
+    if not isinstance(data, dict):
+        return {}
+    overrides = {}
+    for key, cast in PROFILE_KEYS.items():
+        if key in data and data[key] is not None:
+            try:
+                overrides[key] = cast(data[key])
+            except (TypeError, ValueError):
+                continue
+            if key in MIN_VALUES:
+                overrides[key] = max(overrides[key], MIN_VALUES[key])
+    return overrides
+
+
+def save_overrides(overrides: dict) -> None:
+    """
+    Guarda los ajustes del despliegue; un valor None vuelve al automático.
+    """
+    clean = {k: PROFILE_KEYS[k](v) for k, v in overrides.items()
+             if k in PROFILE_KEYS and v is not None}
+    # JSON plano: el fichero también se edita a mano por despliegue
+    save_json(clean, PROFILE_FILE, checksum=False)
+
+
+def load_profile() -> dict:
+    """
+    Perfil efectivo: valores automáticos + ajustes guardados.
+    """
+    profile = default_profile()
+    profile.update(load_overrides())
+    # n_batch nunca mayor que el contexto
+    profile["n_batch"] = min(profile["n_batch"], profile["n_ctx"])
+    # ni un prompt de chat que no deje sitio a la respuesta
+    profile["chat_prompt_budget"] = min(
+        profile["chat_prompt_budget"], profile["n_ctx"] - CHAT_MIN_REPLY_TOKENS
+    )
+    return profile
+
+
+def llama_kwargs(profile: dict) -> dict:
+    """
+    Argumentos de Llama(...) a partir del perfil.
+    """
+    return {key: profile[key] for key in LLAMA_KEYS}
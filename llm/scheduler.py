@@ -0,0 +1,132 @@
+# llm/scheduler.py
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+# Clases de prioridad (menor = más urgente)
+EMERGENCY  = 0
+CHAT       = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {EMERGENCY: "emergency", CHAT: "chat", BACKGROUND: "background"}
+
+
+class GenerationPreempted(Exception):
+    """La generación se cortó para dejar paso a una tarea más prioritaria."""
+
+
+class _Job:
+    __slots__ = ("priority", "fn", "cancel", "future", "enqueued", "preempted")
+
+    def __init__(self, priority: int, fn, cancel: threading.Event):
+        self.priority  = priority
+        self.fn        = fn
+        self.cancel    = cancel
+        self.future    = concurrent.futures.Future()
+        self.enqueued  = time.perf_counter()
+        self.preempted = False
+
+
+class InferenceScheduler:
+    """
+    Cola de inferencia con prioridades sobre un único hilo de trabajo
+    (el modelo no admite llamadas concurrentes).
+
+    Las tareas salen por prioridad y, dentro de la misma prioridad, en
+    orden de llegada. Al encolar una tarea más urgente que la que está en
+    curso se activa el evento `cancel` de esta última: la generación se
+    detiene en el siguiente token y su future termina con
+    GenerationPreempted. fn devuelve un dict con "cut": True si se
+    detuvo por `cancel`; si terminó antes de ver el evento, el resultado
+    está completo y se entrega igual.
+    """
+
+    def __init__(self):
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current: _Job | None = None
+        self._thread: threading.Thread | None = None
+        self._stats = {
+            p: {"jobs": 0, "preempted": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for p in PRIORITY_NAMES
+        }
+
+    def submit(self, fn, priority: int = CHAT,
+               cancel: threading.Event | None = None) -> concurrent.futures.Future:
+        """
+        Encola fn() con la prioridad dada. `cancel` es el evento que fn
+        consulta para cortar la generación (se crea uno si no se pasa).
+        """
+        job = _Job(priority, fn, cancel or threading.Event())
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name="gemma-inference", daemon=True
+                )
+                self._thread.start()
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            current = self._current
+            if current is not None and current.priority > priority and not current.cancel.is_set():
+                current.preempted = True
+                current.cancel.set()
+                self._stats[current.priority]["preempted"] += 1
+            self._cond.notify()
+        return job.future
+
+    def metrics(self) -> dict:
+        """Profundidad de cola y tiempos de espera (s) por prioridad."""
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._heap:
+                depth[PRIORITY_NAMES[priority]] += 1
+            per_class = {}
+            for priority, st in self._stats.items():
+                per_class[PRIORITY_NAMES[priority]] = {
+                    "jobs": st["jobs"],
+                    "preempted": st["preempted"],
+                    "wait_avg": st["wait_total"] / st["jobs"] if st["jobs"] else 0.0,
+                    "wait_max": st["wait_max"],
+                }
+            running = self._current
+            return {
+                "queue_depth": depth,
+                "running": PRIORITY_NAMES[running.priority] if running else None,
+                "classes": per_class,
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                # Cancelada mientras esperaba: ni siquiera se evalúa el prompt
+                if job.cancel.is_set():
+                    job.future.cancel()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                wait = time.perf_counter() - job.enqueued
+                st = self._stats[job.priority]
+                st["jobs"] += 1
+                st["wait_total"] += wait
+                st["wait_max"] = max(st["wait_max"], wait)
+                self._current = job
+
+            try:
+                result = job.fn()
+            except BaseException as ex:
+                job.future.set_exception(ex)
+            else:
+                if job.preempted and isinstance(result, dict) and result.get("cut"):
+                    job.future.set_exception(GenerationPreempted())
+                else:
+                    job.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._current = None
+
+
+scheduler = InferenceScheduler()
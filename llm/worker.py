@@ -0,0 +1,217 @@
+# llm/worker.py
+"""
+Proceso de inferencia compartido.
+
+Carga el modelo una sola vez y atiende peticiones por un socket local
+(multiprocessing.connection, con authkey). La app y cualquier otro
+proceso (p. ej. el visor de PDF) se conectan con connect_worker() o el
+backend "worker" (ver llm.backends.worker) sin cargar su propia copia.
+
+Protocolo: cada petición es un dict {"op", ...}; las respuestas son
+{"result": ...} o {"error": "..."}. "stream" responde con varios
+{"delta": "..."} y un {"done": True, "context_tokens": n} final; el
+cliente puede enviar {"op": "cancel"} mientras recibe deltas. "stats"
+devuelve los contadores de la caché KV del motor ({} si no tiene).
+
+Uso directo: python -m llm.worker [--backend stub]
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+import concurrent.futures
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+from jsonfile import load_json, save_json
+
+# ─── Endpoint publicado en APPDATA ─────────────────────────────
+APPDATA_DIR = Path(
+    os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
+) / "GemiASD"
+APPDATA_DIR.mkdir(parents=True, exist_ok=True)
+
+ENDPOINT_FILE = APPDATA_DIR / "worker.json"
+HOST = "127.0.0.1"
+SPAWN_TIMEOUT_S = 30.0
+
+
+# ─── Servidor ──────────────────────────────────────────────────
+def _engine_profile(backend_name: str | None) -> dict:
+    """
+    Perfil de ejecución del worker: el motor real nunca es "worker".
+    """
+    from .runtime_profile import load_profile
+
+    profile = load_profile()
+    if backend_name:
+        profile["backend"] = backend_name
+    if profile["backend"] == "worker":
+        profile["backend"] = "llama_cpp"
+    return profile
+
+
+class _Worker:
+    def __init__(self, backend_name: str | None):
+        self._backend_name = backend_name
+        self._backend: concurrent.futures.Future = concurrent.futures.Future()
+        # Un solo modelo: las generaciones se atienden de una en una
+        self._model_lock = threading.Lock()
+
+    def load(self):
+        try:
+            from .backends import create_backend
+            from .model_manager import warm_up
+
+            profile = _engine_profile(self._backend_name)
+            backend = create_backend(profile)
+            warm_up(backend, profile)
+        except BaseException as ex:
+            self._backend.set_exception(ex)
+            return
+        self._backend.set_result(backend)
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    req = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = req.get("op")
+                if op == "cancel":
+                    # Cancelación que llegó tras terminar el stream
+                    continue
+                try:
+                    if op == "ping":
+                        conn.send({"result": os.getpid()})
+                    elif op == "stream":
+                        self._stream(conn, req)
+                    else:
+                        conn.send({"result": self._call(op, req)})
+                except (EOFError, OSError, BrokenPipeError):
+                    return
+                except Exception as ex:
+                    conn.send({"error": f"{type(ex).__name__}: {ex}"})
+
+    def _call(self, op: str, req: dict):
+        backend = self._backend.result()
+        if op == "info":
+            return {"name": backend.name, "model_id": backend.model_id,
+                    "pid": os.getpid()}
+        if op == "tokenize":
+            # Solo vocabulario: no toca el contexto, no espera al modelo
+            return backend.tokenize(req["text"])
+        if op == "stats":
+            stats = getattr(backend, "kv_cache_stats", None)
+            with self._model_lock:
+                return stats() if stats is not None else {}
+        if op == "embed":
+            # Usa el mismo llama_context que las generaciones
+            with self._model_lock:
+                return backend.embed(req["text"])
+        if op == "complete":
+            with self._model_lock:
+                text = backend.complete(req["messages"], **req.get("kw", {}))
+                return {"text": text, "context_tokens": backend.context_tokens}
+        raise ValueError(f"unknown op {op!r}")
+
+    def _stream(self, conn, req: dict):
+        backend = self._backend.result()
+        with self._model_lock:
+            deltas = backend.stream(req["messages"], **req.get("kw", {}))
+            try:
+                for delta in deltas:
+                    conn.send({"delta": delta})
+                    # ¿Pidió el cliente parar? (se revisa entre tokens)
+                    if conn.poll() and conn.recv().get("op") == "cancel":
+                        break
+            finally:
+                deltas.close()
+            conn.send({"done": True, "context_tokens": backend.context_tokens})
+
+
+def _publish(port: int, authkey: bytes) -> None:
+    save_json({
+        "port": port,
+        "authkey": authkey.hex(),
+        "pid": os.getpid(),
+    }, ENDPOINT_FILE, indent=None, backup=False)
+
+
+def _unpublish() -> None:
+    try:
+        if load_json(ENDPOINT_FILE).get("pid") == os.getpid():
+            ENDPOINT_FILE.unlink()
+    except (OSError, ValueError, KeyError):
+        pass
+
+
+def serve(backend_name: str | None = None) -> None:
+    """
+    Bucle principal del worker. Si ya hay otro worker vivo, sale.
+    """
+    if _try_connect() is not None:
+        return
+    authkey = secrets.token_bytes(32)
+    listener = Listener((HOST, 0), authkey=authkey)
+    worker = _Worker(backend_name)
+    threading.Thread(target=worker.load, name="worker-loader", daemon=True).start()
+
+    _publish(listener.address[1], authkey)
+    atexit.register(_unpublish)
+    with listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            threading.Thread(target=worker.handle, args=(conn,), daemon=True).start()
+
+
+# ─── Cliente ───────────────────────────────────────────────────
+def _try_connect():
+    """
+    Conexión al worker publicado, o None si no hay ninguno vivo.
+    """
+    try:
+        info = load_json(ENDPOINT_FILE)
+        conn = Client((HOST, info["port"]), authkey=bytes.fromhex(info["authkey"]))
+    except (OSError, ValueError, KeyError, EOFError,
+            multiprocessing.AuthenticationError):
+        return None
+    return conn
+
+
+def connect_worker(spawn: bool = True, timeout: float = SPAWN_TIMEOUT_S):
+    """
+    Conecta con el worker compartido; si no hay ninguno y spawn=True lo
+    arranca como proceso hijo y espera a que publique su endpoint.
+    """
+    conn = _try_connect()
+    if conn is not None or not spawn:
+        if conn is None:
+            raise ConnectionError("inference worker is not running")
+        return conn
+
+    ctx = multiprocessing.get_context("spawn")
+    proc = ctx.Process(target=serve, name="gemi-inference", daemon=True)
+    proc.start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = _try_connect()
+        if conn is not None:
+            return conn
+        if not proc.is_alive() and proc.exitcode not in (None, 0):
+            break
+        time.sleep(0.05)
+    raise ConnectionError("inference worker did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemi shared inference worker")
+    parser.add_argument("--backend", help="motor real (llama_cpp | stub | server)")
+    serve(parser.parse_args().backend)
@@ -0,0 +1,143 @@
+# notifications.py
+import atexit
+import heapq
+import itertools
+import threading
+from datetime import datetime
+from typing import Callable
+
+# Espera máxima entre comprobaciones: el reloj de pared puede saltar
+# (suspensión del equipo, cambio de hora) y las dosis son de pared.
+MAX_WAIT_S = 60.0
+
+
+class _Entry:
+    __slots__ = ("when", "handle", "callback", "args", "alive")
+
+    def __init__(self, when: datetime, handle: int, callback: Callable, args: tuple):
+        self.when     = when
+        self.handle   = handle
+        self.callback = callback
+        self.args     = args
+        self.alive    = True
+
+
+class NotificationScheduler:
+    """
+    Avisos programados sobre un montículo (heap) y un único hilo.
+
+    add()/reschedule() cuestan O(log n) y cancel() O(1): la entrada
+    cancelada se marca y se descarta al llegar a la cima, y el heap se
+    reconstruye si las canceladas pasan a ser mayoría. Haya las dosis
+    que haya, solo existe un hilo, que duerme hasta la próxima.
+
+    Los callbacks se ejecutan en ese hilo, de uno en uno.
+    """
+
+    def __init__(self):
+        self._heap: list = []
+        self._entries: dict[int, _Entry] = {}
+        self._seq = itertools.count()
+        self._handles = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+        self.fired = 0
+
+    def add(self, when: datetime, callback: Callable, *args) -> int:
+        """Programa callback(*args) para `when`; devuelve un id para cancelarlo."""
+        with self._cond:
+            handle = next(self._handles)
+            self._push(_Entry(when, handle, callback, args))
+            return handle
+
+    def cancel(self, handle: int) -> bool:
+        with self._cond:
+            entry = self._entries.pop(handle, None)
+            if entry is None:
+                return False
+            entry.alive = False
+            self._compact()
+            self._cond.notify()
+            return True
+
+    def reschedule(self, handle: int, when: datetime) -> bool:
+        with self._cond:
+            entry = self._entries.pop(handle, None)
+            if entry is None:
+                return False
+            entry.alive = False
+            self._push(_Entry(when, handle, entry.callback, entry.args))
+            return True
+
+    def next_due(self) -> datetime | None:
+        """Hora del próximo aviso pendiente (None si no hay)."""
+        with self._cond:
+            self._drop_dead()
+            return self._heap[0][0] if self._heap else None
+
+    def clear(self) -> None:
+        with self._cond:
+            self._heap.clear()
+            self._entries.clear()
+            self._cond.notify()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._entries.clear()
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    # ─── Interno (con self._cond tomado) ───────────────────────
+    def _push(self, entry: _Entry) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._worker, name="notifications", daemon=True
+            )
+            self._thread.start()
+        self._entries[entry.handle] = entry
+        heapq.heappush(self._heap, (entry.when, next(self._seq), entry))
+        # Despierta al hilo solo si hay un aviso nuevo más próximo
+        if self._heap[0][2] is entry:
+            self._cond.notify()
+
+    def _drop_dead(self) -> None:
+        while self._heap and not self._heap[0][2].alive:
+            heapq.heappop(self._heap)
+
+    def _compact(self) -> None:
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [item for item in self._heap if item[2].alive]
+            heapq.heapify(self._heap)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    self._drop_dead()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = (self._heap[0][0] - datetime.now()).total_seconds()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(min(delay, MAX_WAIT_S))
+                entry = heapq.heappop(self._heap)[2]
+                self._entries.pop(entry.handle, None)
+                entry.alive = False
+                self.fired += 1
+            try:
+                entry.callback(*entry.args)
+            except Exception as ex:
+                print(f"[notifications] callback failed: {ex}")
+
+
+notification_scheduler = NotificationScheduler()
+atexit.register(notification_scheduler.shutdown)
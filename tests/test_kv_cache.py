@@ -0,0 +1,56 @@
+# tests/test_kv_cache.py
+import pytest
+
+from llm.kv_cache import PrefixCache, MIN_REUSE_TOKENS
+
+# BOS + "<start_of_turn>user\n": lo que comparten todos los prompts
+HEADER = (2, 105, 2364, 107)
+
+
+class _State:
+    llama_state_size = 1
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+def _prompt(*body: int) -> tuple:
+    return HEADER + body
+
+
+@pytest.fixture
+def cache() -> PrefixCache:
+    cache = PrefixCache()
+    # Prefijos de calentamiento: sistema de chat y de emergencia
+    cache.pin(_prompt(*range(100, 130)), _State("chat"))
+    cache.pin(_prompt(*range(200, 240)), _State("emergency"))
+    return cache
+
+
+def test_prompt_with_full_pinned_prefix_is_a_pinned_hit(cache):
+    state = cache[_prompt(*range(100, 130), 7, 8, 9)]
+    assert state.name == "chat"
+    assert (cache.hits, cache.pinned_hits, cache.misses) == (1, 1, 0)
+
+
+@pytest.mark.parametrize("body", [
+    range(300, 340),         # resumen del historial
+    range(400, 420),         # interpretar un tratamiento
+    range(100, 110),         # empieza como el chat pero no cubre el prefijo fijado
+])
+def test_other_prompt_kinds_are_misses(cache, body):
+    key = _prompt(*body)
+    assert key not in cache
+    with pytest.raises(KeyError):
+        cache[key]
+    assert (cache.hits, cache.pinned_hits, cache.misses) == (0, 0, 1)
+
+
+def test_lru_needs_a_meaningful_common_prefix(cache):
+    turn = _prompt(*range(500, 500 + MIN_REUSE_TOKENS))
+    cache[turn] = _State("turn")
+
+    assert cache[turn + (1, 2)].name == "turn"
+    with pytest.raises(KeyError):
+        cache[_prompt(*range(600, 640))]
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,67 @@
+# tests/test_treatment_parser.py
+from datetime import datetime, timedelta
+
+import pytest
+
+from treatment_parser import parse_spec, parse_treatment
+
+# Sábado, media mañana
+NOW = datetime(2026, 10, 17, 10, 30)
+
+
+@pytest.mark.parametrize("text, per_day", [
+    ("Amoxicillin twice a day for 10 days", 2),
+    ("Amoxicillin thrice daily", 3),
+    ("Amoxicillin 3 times a day for 10 days", 3),
+    ("Amoxicillin 3 times daily", 3),
+    ("Amoxicillin 4x per day", 4),
+    ("Amoxicillin one time a day", 1),
+    ("Amoxicillin two times per day", 2),
+    ("Amoxicillin Three times daily for 5 days", 3),
+    ("Amoxicillin four times each day", 4),
+])
+def test_times_a_day(text, per_day):
+    spec = parse_spec(text)
+    assert spec is not None
+    assert spec["name"] == "Amoxicillin"
+    assert spec["per_day"] == per_day
+
+
+def test_times_a_day_spreads_doses_over_the_day():
+    [t] = parse_treatment("Amoxicillin three times a day for 2 days", NOW)
+    rule = t["rule"]
+    assert rule.start == NOW
+    assert rule.interval == timedelta(hours=8)
+    assert rule.count == 6
+
+
+def test_every_hours_starting_at_keeps_todays_remaining_doses():
+    [t] = parse_treatment("Ibuprofen every 8 hours for 7 days starting at 6am", NOW)
+    rule = t["rule"]
+    assert t["medicine"] == "Ibuprofen"
+    assert rule.start == datetime(2026, 10, 17, 14, 0)
+    assert rule.interval == timedelta(hours=8)
+    doses = list(rule.between(NOW, NOW + timedelta(days=1)))
+    assert doses[:3] == [datetime(2026, 10, 17, 14, 0),
+                         datetime(2026, 10, 17, 22, 0),
+                         datetime(2026, 10, 18, 6, 0)]
+
+
+def test_every_hours_starting_at_a_later_time_today():
+    [t] = parse_treatment("Ibuprofen every 6 hours starting at 8pm", NOW)
+    assert t["rule"].start == datetime(2026, 10, 17, 20, 0)
+
+
+def test_every_hours_starting_on_a_later_day():
+    [t] = parse_treatment("Ibuprofen every 8 hours starting tomorrow at 6am", NOW)
+    assert t["rule"].start == datetime(2026, 10, 18, 6, 0)
+
+
+def test_daily_at_a_past_time_starts_tomorrow():
+    [t] = parse_treatment("Vitamin D daily at 9am", NOW)
+    assert t["rule"].start == datetime(2026, 10, 18, 9, 0)
+    assert t["rule"].interval == timedelta(days=1)
+
+
+def test_unrecognised_text_is_left_to_the_model():
+    assert parse_spec("Amoxicillin as the doctor said") is None
@@ -0,0 +1,334 @@
+# treatment_parser.py
+"""
+Tratamientos y citas escritos en lenguaje natural → reglas de recurrencia.
+
+Primero se prueban reglas deterministas (expresiones regulares
+compiladas al importar y resultado memorizado por texto) que cubren las
+formas habituales:
+
+    Ibuprofen 400mg every 8 hours x 7 days
+    Amoxicillin 3 times a day for 10 days
+    Vitamin D daily at 9am
+    Metformin at 8:00 and 20:00 until Nov 30
+    Methotrexate every monday at 8pm for 12 weeks
+    Dentist appointment on Nov 3 at 10:30
+
+Solo si no encajan se pregunta al modelo (gemma_wrapper.
+parse_treatment_async), con la salida restringida por gramática al mismo
+formato de especificación. Ambos caminos acaban en build_treatments().
+"""
+import re
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+from treatments import Recurrence
+
+# Hora si el texto no da ninguna (citas, días de la semana, "starting …")
+DEFAULT_TIME = time(9, 0)
+PARSE_CACHE_SIZE = 256
+
+_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun",
+           "jul", "aug", "sep", "oct", "nov", "dec")
+_NAMED_TIMES = {
+    "morning": "08:00", "noon": "12:00", "midday": "12:00", "afternoon": "15:00",
+    "evening": "20:00", "night": "22:00", "bedtime": "22:00", "midnight": "00:00",
+}
+_PER_DAY_WORDS = {"once": 1, "twice": 2, "thrice": 3}
+_NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                 "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12}
+_UNIT_HOURS = {"h": 1, "hr": 1, "hour": 1, "day": 24, "week": 168}
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30}
+
+# Palabras que pueden quedar sueltas entre las partes reconocidas
+_FILLER = {
+    "take", "takes", "taking", "give", "and", "then", "of", "the", "a", "an",
+    "with", "please", "each", "dose", "doses", "pill", "pills", "tablet",
+    "tablets", "on", "at", "in", "starting", "from",
+}
+_LEADING_VERBS = ("take ", "takes ", "give ")
+
+# ─── Gramática ─────────────────────────────────────────────────
+_DAY   = r"(?:mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:rs(?:day)?)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)s?"
+_TIME  = r"(?:\d{1,2}(?::\d{2})?\s*(?:am|pm)?|noon|midday|midnight)"
+_MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sept?|oct|nov|dec)[a-z]*\.?"
+_DATE  = (
+    r"(?:today|tomorrow|\d{4}-\d{2}-\d{2}"
+    rf"|{_MONTH}\s+\d{{1,2}}(?:st|nd|rd|th)?(?:,?\s*\d{{4}})?"
+    rf"|\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?{_MONTH}(?:,?\s*\d{{4}})?"
+    rf"|(?:next\s+)?{_DAY})"
+)
+
+
+def _list_of(item: str) -> str:
+    return rf"{item}(?:\s*(?:,|and|&)\s*{item})*"
+
+
+def _rx(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+_APPOINTMENT = _rx(r"\b(?:appointment|appt|visit|check-?up|consultation|dentist|doctor|dr)\b")
+_RX_UNTIL    = _rx(rf"\b(?:until|till|through)\s+(?P<d>{_DATE})(?!\w)")
+_RX_START    = _rx(rf"\b(?:starting|start|from|beginning)\s+(?:on\s+)?(?P<d>{_DATE})(?!\w)")
+_RX_PER_DAY  = _rx(rf"\b(?:(?P<w>{'|'.join(_PER_DAY_WORDS)})"
+                   rf"|(?P<n>\d+|{'|'.join(_NUMBER_WORDS)})\s*(?:times?|x))\s*"
+                   r"(?:(?:a|per|each|every)\s+day|daily)\b")
+_RX_EVERY    = _rx(r"\bevery\s+(?:(?P<n>\d+(?:\.\d+)?)\s*|(?P<other>other)\s+)?"
+                   r"(?P<u>hours?|hrs?|h|days?|weeks?)\b")
+_RX_DAILY    = _rx(r"\bdaily\b")
+_RX_DURATION = _rx(r"(?:\bx|\bfor|\bduring)\s*(?P<n>\d+)\s*(?P<u>days?|weeks?|months?)\b")
+_RX_TIMES    = _rx(rf"(?:\bat|@)\s*(?P<t>{_list_of(_TIME)})(?!\w)")
+_RX_NAMED    = _rx(r"\b(?:in\s+the\s+|at\s+|every\s+)?(?P<t>morning|afternoon|evening|night|bedtime)s?\b")
+_RX_WEEKDAYS = _rx(rf"\b(?:on|every)\s+(?P<d>{_list_of(_DAY)})(?!\w)")
+_RX_DATE     = _rx(rf"\b(?:on\s+)?(?P<d>{_DATE})(?!\w)")
+
+_RX_ITEM_TIME = _rx(_TIME)
+_RX_ITEM_DAY  = _rx(_DAY)
+
+
+# ─── Normalización de horas y fechas ───────────────────────────
+def _clock(token: str) -> str:
+    """'8pm', '20:00', 'noon' … → 'HH:MM'."""
+    token = token.strip().lower()
+    if token in _NAMED_TIMES:
+        return _NAMED_TIMES[token]
+    m = re.fullmatch(r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?", token)
+    if not m:
+        raise ValueError(f"bad time {token!r}")
+    hour, minute = int(m[1]), int(m[2] or 0)
+    if m[3]:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"bad time {token!r}")
+        hour = hour % 12 + (12 if m[3] == "pm" else 0)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"bad time {token!r}")
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _resolve_date(token: str, today: date) -> date:
+    """'tomorrow', 'friday', 'Nov 3', '2026-11-03' … → fecha (la próxima)."""
+    token = token.strip().lower()
+    if token == "today":
+        return today
+    if token == "tomorrow":
+        return today + timedelta(days=1)
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", token):
+        return date.fromisoformat(token)
+    m = re.fullmatch(rf"(next\s+)?(?P<d>{_DAY})", token)
+    if m:
+        ahead = (_WEEKDAYS.index(m["d"][:3]) - today.weekday()) % 7
+        return today + timedelta(days=ahead or (7 if m[1] else 0))
+    month = next((i for i, name in enumerate(_MONTHS, 1)
+                  if re.search(rf"\b{name}", token)), None)
+    day = re.search(r"\b(\d{1,2})(?:st|nd|rd|th)?\b", token)
+    year = re.search(r"\b(\d{4})\b", token)
+    if month is None or day is None:
+        raise ValueError(f"bad date {token!r}")
+    if year:
+        return date(int(year[1]), month, int(day[1]))
+    result = date(today.year, month, int(day[1]))
+    return result if result >= today else date(today.year + 1, month, int(day[1]))
+
+
+# ─── Reglas deterministas ──────────────────────────────────────
+def _new_spec(kind: str) -> dict:
+    # Mismo formato que devuelve el modelo (ver llm.grammars.TREATMENT_GBNF)
+    return {"kind": kind, "name": "", "every_hours": None, "per_day": None,
+            "times": [], "weekdays": [], "date": None, "days": None, "until": None}
+
+
+def _take(pattern: re.Pattern, text: str, spans: list, handle) -> str:
+    """Aplica handle(m) a cada coincidencia y la borra del texto."""
+    for m in pattern.finditer(text):
+        handle(m)
+        spans.append(m.start())
+    return pattern.sub(lambda m: " " * len(m[0]), text)
+
+
+def _match_appointment(text: str) -> dict | None:
+    spec = _new_spec("appointment")
+    spans: list[int] = []
+    rest = _take(_RX_TIMES, text, spans,
+                 lambda m: spec["times"].extend(_clock(t) for t in _RX_ITEM_TIME.findall(m["t"])))
+    rest = _take(_RX_DATE, rest, spans, lambda m: spec.update(date=spec["date"] or m["d"]))
+    if not spans:
+        return None
+    spec["name"] = re.sub(r"\s+", " ", rest).strip(" ,.-:;")
+    return spec
+
+
+def _match_medication(text: str) -> dict | None:
+    spec = _new_spec("medication")
+    spans: list[int] = []
+
+    def per_day(m):
+        if m["w"]:
+            spec["per_day"] = _PER_DAY_WORDS[m["w"].lower()]
+        else:
+            n = m["n"].lower()
+            spec["per_day"] = _NUMBER_WORDS[n] if n in _NUMBER_WORDS else int(n)
+
+    def every(m):
+        unit = m["u"].lower().rstrip("s")
+        n = 2 if m["other"] else float(m["n"] or 1)
+        spec["every_hours"] = n * _UNIT_HOURS[unit]
+
+    def duration(m):
+        spec["days"] = int(m["n"]) * _UNIT_DAYS[m["u"].lower().rstrip("s")]
+
+    rest = text
+    rest = _take(_RX_UNTIL, rest, spans, lambda m: spec.update(until=m["d"]))
+    rest = _take(_RX_START, rest, spans, lambda m: spec.update(date=m["d"]))
+    rest = _take(_RX_PER_DAY, rest, spans, per_day)
+    rest = _take(_RX_EVERY, rest, spans, every)
+    rest = _take(_RX_DAILY, rest, spans, lambda m: spec.update(every_hours=spec["every_hours"] or 24))
+    rest = _take(_RX_DURATION, rest, spans, duration)
+    rest = _take(_RX_TIMES, rest, spans,
+                 lambda m: spec["times"].extend(_clock(t) for t in _RX_ITEM_TIME.findall(m["t"])))
+    rest = _take(_RX_NAMED, rest, spans, lambda m: spec["times"].append(_clock(m["t"])))
+    rest = _take(_RX_WEEKDAYS, rest, spans,
+                 lambda m: spec["weekdays"].extend(d[:3].lower() for d in _RX_ITEM_DAY.findall(m["d"])))
+
+    if not any((spec["every_hours"], spec["per_day"], spec["times"], spec["weekdays"])):
+        return None
+    # Lo anterior a la primera parte reconocida es el medicamento; lo
+    # que queda suelto después solo puede ser relleno
+    first = min(spans)
+    leftover = re.findall(r"[a-z0-9]+", rest[first:].lower())
+    if any(word not in _FILLER for word in leftover):
+        return None
+    name = text[:first].strip(" ,.-:;")
+    while name.lower().startswith(_LEADING_VERBS):
+        name = name.split(" ", 1)[1].strip()
+    if not name:
+        return None
+    spec["name"] = name[0].upper() + name[1:]
+    spec["times"] = sorted(set(spec["times"]))
+    spec["weekdays"] = sorted(set(spec["weekdays"]), key=_WEEKDAYS.index)
+    return spec
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _match(text: str) -> dict | None:
+    try:
+        if _APPOINTMENT.search(text):
+            return _match_appointment(text)
+        return _match_medication(text)
+    except ValueError:
+        return None
+
+
+def parse_spec(text: str) -> dict | None:
+    """
+    Especificación del tratamiento según las reglas deterministas, o
+    None si no encaja ninguna. No depende de la hora (las fechas quedan
+    como texto), así que se memoriza por texto. No modificar el dict.
+    """
+    return _match(re.sub(r"\s+", " ", text).strip())
+
+
+# ─── Especificación → reglas ───────────────────────────────────
+def build_treatments(spec: dict, now: datetime) -> list[dict]:
+    """
+    [{"medicine", "rule"}] a partir de una especificación (de parse_spec
+    o del modelo). Varias horas o días de la semana dan una regla cada
+    uno. ValueError si la especificación no es válida.
+    """
+    name = str(spec.get("name") or "").strip()
+    if not name:
+        raise ValueError("missing name")
+    today = now.date()
+    times = [time.fromisoformat(_clock(t)) for t in spec.get("times") or []]
+    weekdays = [_WEEKDAYS.index(str(d)[:3].lower()) for d in spec.get("weekdays") or []]
+    start_day = _resolve_date(spec["date"], today) if spec.get("date") else None
+
+    if spec.get("kind") == "appointment":
+        when = datetime.combine(start_day or today, times[0] if times else DEFAULT_TIME)
+        return [{"medicine": name, "rule": Recurrence(when, timedelta(days=1), count=1)}]
+
+    base = datetime.combine(start_day, time()) if start_day else now
+    end = None
+    if spec.get("until"):
+        end = datetime.combine(_resolve_date(spec["until"], today), time.max)
+    days = spec.get("days")
+    if days:
+        by_days = base + timedelta(days=int(days)) - timedelta(microseconds=1)
+        end = by_days if end is None else min(end, by_days)
+
+    every_h = spec.get("every_hours")
+    if every_h is not None and float(every_h) <= 0:
+        raise ValueError("interval must be positive")
+
+    def first(at: time, weekday: int | None = None) -> datetime:
+        when = datetime.combine(base.date(), at)
+        if weekday is not None:
+            when += timedelta(days=(weekday - when.weekday()) % 7)
+        if when < base:
+            when += timedelta(days=7 if weekday is not None else 1)
+        return when
+
+    def first_every(at: time, step: timedelta) -> datetime:
+        # La serie parte de esa hora del primer día; si ya pasó, la
+        # primera toma es la siguiente de la serie, no la del día siguiente
+        when = datetime.combine(base.date(), at)
+        if when < base:
+            when -= ((when - base) // step) * step
+        return when
+
+    rules = []
+    if weekdays:
+        for wd in weekdays:
+            for at in times or [DEFAULT_TIME]:
+                rules.append(Recurrence(first(at, wd), timedelta(weeks=1), until=end))
+    elif times and every_h and float(every_h) < 24:
+        # "every 8 hours starting at 6am": una regla desde la primera hora
+        step = timedelta(hours=float(every_h))
+        rules.append(Recurrence(first_every(times[0], step), step, until=end))
+    elif times:
+        interval = timedelta(hours=float(every_h)) if every_h else timedelta(days=1)
+        rules.extend(Recurrence(first(at), interval, until=end) for at in times)
+    else:
+        if every_h:
+            interval = timedelta(hours=float(every_h))
+        elif spec.get("per_day"):
+            interval = timedelta(hours=24 / int(spec["per_day"]))
+        else:
+            raise ValueError("no frequency")
+        start = datetime.combine(start_day, DEFAULT_TIME) if start_day else now
+        if days and not spec.get("until"):
+            # Como antes: "x 5 days" cada 8 h son 5·24/8 = 15 tomas
+            count = timedelta(days=int(days)) // interval
+            rules.append(Recurrence(start, interval, count=count))
+        else:
+            rules.append(Recurrence(start, interval, until=end))
+    return [{"medicine": name, "rule": rule} for rule in rules]
+
+
+def parse_treatment(text: str, now: datetime | None = None) -> list[dict] | None:
+    """Solo reglas deterministas; None si el texto no encaja."""
+    spec = parse_spec(text)
+    if spec is None:
+        return None
+    try:
+        return build_treatments(spec, now or datetime.now())
+    except ValueError:
+        return None
+
+
+async def parse_treatment_async(text: str, now: datetime | None = None) -> list[dict] | None:
+    """
+    Reglas deterministas y, si no encajan, el modelo (con gramática).
+    None si ninguno de los dos da un tratamiento válido.
+    """
+    now = now or datetime.now()
+    spec = parse_spec(text)
+    if spec is None:
+        from llm import gemma_wrapper
+        spec = await gemma_wrapper.parse_treatment_async(text, now.strftime("%Y-%m-%d (%A)"))
+        if spec is None:
+            return None
+    try:
+        return build_treatments(spec, now)
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,184 @@
+# treatments.py
+"""
+Tratamientos como reglas de recurrencia.
+
+Un tratamiento no guarda cada toma: guarda el inicio, el intervalo,
+el final (número de tomas y/o fecha límite, o ninguno si es indefinido)
+y las tomas anuladas. Las tomas se calculan solo para la ventana que se
+pide (un mes del calendario, un día, las próximas horas de avisos).
+"""
+from bisect import insort
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from math import gcd
+from functools import reduce
+from typing import Iterable, Iterator
+
+# Un horario irregular se convierte en regla con huecos (exceptions)
+# solo si la rejilla no sale mucho mayor que el propio horario.
+_MAX_GRID_FACTOR = 4
+
+_MICROSECOND = timedelta(microseconds=1)
+
+# Meses expandidos que guarda DoseIndex (LRU)
+INDEX_MONTHS = 24
+
+
+class Recurrence:
+    """
+    Tomas start, start + interval, start + 2·interval… hasta `count`
+    tomas y/o hasta `until` (inclusive), menos las de `exceptions`.
+    """
+    __slots__ = ("start", "interval", "count", "until", "exceptions")
+
+    def __init__(
+        self,
+        start: datetime,
+        interval: timedelta,
+        count: int | None = None,
+        until: datetime | None = None,
+        exceptions: Iterable[datetime] = (),
+    ):
+        if interval <= timedelta(0):
+            raise ValueError("interval must be positive")
+        self.start      = start
+        self.interval   = interval
+        self.count      = count
+        self.until      = until
+        self.exceptions = frozenset(exceptions)
+
+    def __repr__(self) -> str:
+        return (f"Recurrence({self.start.isoformat()}, every {self.interval}, "
+                f"count={self.count}, until={self.until}, "
+                f"{len(self.exceptions)} exceptions)")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Recurrence) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__
+        )
+
+    def _first_index(self, when: datetime) -> int:
+        """Índice de la primera toma >= when."""
+        if when <= self.start:
+            return 0
+        return -((self.start - when) // self.interval)
+
+    def _stop_index(self) -> int | None:
+        """Índice tras la última toma (None si no tiene fin)."""
+        stop = self.count
+        if self.until is not None:
+            by_date = 0 if self.until < self.start else (self.until - self.start) // self.interval + 1
+            stop = by_date if stop is None else min(stop, by_date)
+        return stop
+
+    def between(self, start: datetime, end: datetime) -> Iterator[datetime]:
+        """Tomas en [start, end), en orden; cuesta lo que tenga la ventana."""
+        i = self._first_index(start)
+        stop = self._stop_index()
+        while stop is None or i < stop:
+            dt = self.start + self.interval * i
+            if dt >= end:
+                return
+            if dt not in self.exceptions:
+                yield dt
+            i += 1
+
+    def total(self) -> int | None:
+        """Número de tomas (None si no tiene fin)."""
+        stop = self._stop_index()
+        if stop is None:
+            return None
+        return max(stop, 0) - sum(1 for dt in self.exceptions if self._is_slot(dt, stop))
+
+    def _is_slot(self, dt: datetime, stop: int) -> bool:
+        offset = dt - self.start
+        return (offset >= timedelta(0) and offset % self.interval == timedelta(0)
+                and offset // self.interval < stop)
+
+    def skip(self, when: datetime) -> "Recurrence":
+        """Misma regla con la toma `when` anulada."""
+        return Recurrence(self.start, self.interval, self.count, self.until,
+                          self.exceptions | {when})
+
+
+def from_schedule(schedule: Iterable[datetime]) -> list[Recurrence]:
+    """
+    Convierte una lista de tomas (formato antiguo) en reglas. Un horario
+    a intervalos regulares, el caso normal, da una sola regla; si es
+    irregular se usa la rejilla del máximo común divisor con las tomas
+    que faltan como excepciones y, si esa rejilla sale demasiado grande,
+    una regla de una sola toma por cada una.
+    """
+    doses = sorted(set(schedule))
+    if not doses:
+        return []
+    if len(doses) == 1:
+        return [Recurrence(doses[0], timedelta(days=1), count=1)]
+
+    steps = [(b - a) // _MICROSECOND for a, b in zip(doses, doses[1:])]
+    interval = timedelta(microseconds=reduce(gcd, steps))
+    count = (doses[-1] - doses[0]) // interval + 1
+    if count > _MAX_GRID_FACTOR * len(doses):
+        return [Recurrence(dt, timedelta(days=1), count=1) for dt in doses]
+
+    taken = set(doses)
+    missing = (doses[0] + interval * i for i in range(count))
+    return [Recurrence(doses[0], interval, count=count,
+                       exceptions=[dt for dt in missing if dt not in taken])]
+
+
+def _month_bounds(year: int, month: int) -> tuple[datetime, datetime]:
+    return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+
+
+class DoseIndex:
+    """
+    Índice fecha → tomas del día [(hora, medicamento, id)], ordenadas.
+
+    Se llena por meses, la primera vez que se pide uno (las reglas
+    pueden no tener fin, así que no se expande todo). Al añadir un
+    tratamiento solo se tocan los días de los meses ya indexados, sin
+    recalcular el resto. Pintar un mes o elegir un día cuesta lo que sus
+    celdas y sus tomas, no lo que todos los horarios.
+    """
+
+    def __init__(self, treatments: Iterable[dict] = (), max_months: int = INDEX_MONTHS):
+        self.max_months = max_months
+        self._treatments: dict[int, dict] = {t["id"]: t for t in treatments}
+        self._months: OrderedDict[tuple[int, int], dict[date, list]] = OrderedDict()
+
+    def _month(self, year: int, month: int) -> dict[date, list]:
+        key = (year, month)
+        days = self._months.get(key)
+        if days is not None:
+            self._months.move_to_end(key)
+            return days
+        days = {}
+        start, end = _month_bounds(year, month)
+        for t in self._treatments.values():
+            medicine, tid = t.get("medicine", ""), t["id"]
+            for dt in t["rule"].between(start, end):
+                days.setdefault(dt.date(), []).append((dt, medicine, tid))
+        for doses in days.values():
+            doses.sort()
+        self._months[key] = days
+        if len(self._months) > self.max_months:
+            self._months.popitem(last=False)
+        return days
+
+    @staticmethod
+    def _insert(days: dict[date, list], treatment: dict, start: datetime, end: datetime) -> None:
+        medicine, tid = treatment.get("medicine", ""), treatment["id"]
+        for dt in treatment["rule"].between(start, end):
+            insort(days.setdefault(dt.date(), []), (dt, medicine, tid))
+
+    def add(self, treatment: dict) -> None:
+        self._treatments[treatment["id"]] = treatment
+        for (year, month), days in self._months.items():
+            self._insert(days, treatment, *_month_bounds(year, month))
+
+    def days_with_doses(self, year: int, month: int) -> set[int]:
+        return {d.day for d in self._month(year, month)}
+
+    def on_day(self, day: date) -> list[tuple[datetime, str, int]]:
+        return self._month(day.year, day.month).get(day, [])
@@ -1,19 +1,25 @@
 # utils.py
 
+import atexit
+import copy
 import json
 import re
 import os
 import shutil
-import asyncio
+import threading
+import time
 from pathlib import Path
-from datetime import datetime    # <-- Import necesario para la serialización
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional
 
 from text_utils import clean_emoji_text        # única función de limpieza
+from datastore import store, USER_DOC, PROFILE_DOC
 from llm.gemma_wrapper import (
-    medichat_async,
-    emergency_async,
+    medichat_stream_async,
+    emergency_stream_async,
+    EMERGENCY_MAX_TOKENS,
 )
+from llm.model_manager import model_manager
+from llm.response_cache import emergency_cache
 
 # 1) Definir APPDATA\GemiASD como carpeta de datos
 APPDATA_DIR = Path(
@@ -24,10 +30,8 @@ APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 # ------------------------------------------------------------------
 # Rutas de datos
 # ------------------------------------------------------------------
+# Usuario, perfil, chat, tratamientos y PDFs viven en datastore (SQLite)
 DATA_DIR        = APPDATA_DIR
-PROFILE_PATH    = DATA_DIR / "profile_data.json"
-CHAT_DATA_PATH  = DATA_DIR / "chat_data.json"
-USER_DATA_PATH  = DATA_DIR / "gemi_user_data.json"
 PDF_CACHE_DIR   = DATA_DIR / "pdfs"
 PHOTOS_DIR      = DATA_DIR / "photos"
 ASSETS_DIR      = DATA_DIR / "assets"
@@ -37,14 +41,12 @@ ASSETS_DIR      = DATA_DIR / "assets"
 # ------------------------------------------------------------------
 def clear_user_data() -> None:
     """
-    Borra todos los JSONs de usuario/chat y limpia cachés de PDFs y fotos.
+    Borra los datos de usuario/perfil/chat/tratamientos del almacén y
+    limpia cachés de PDFs, fotos y evaluaciones de emergencia.
     """
-    # Eliminar archivos JSON
-    for p in (USER_DATA_PATH, PROFILE_PATH, CHAT_DATA_PATH):
-        try:
-            p.unlink()
-        except FileNotFoundError:
-            pass
+    pending_saves.discard()
+    store.clear_all()
+    emergency_cache.clear()
 
     # Limpiar caché de PDFs
     if PDF_CACHE_DIR.exists():
@@ -67,56 +69,166 @@ def ensure_data_dir() -> Path:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     return DATA_DIR
 
-def load_json(path: Path) -> Dict[str, Any]:
-    """
-    Carga un JSON desde la ruta indicada. Si no existe, devuelve {}.
-    """
-    if not path.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return {}
-    try:
-        txt = path.read_text(encoding="utf-8").strip()
-        return json.loads(txt) if txt else {}
-    except json.JSONDecodeError:
-        return {}
+# ------------------------------------------------------------------
+# Escritura diferida (write-behind)
+# ------------------------------------------------------------------
+# Segundos sin cambios antes de escribir en disco
+SAVE_QUIET_S = 0.5
 
-def save_json(data: Any, path: Path) -> None:
-    """
-    Guarda cualquier objeto en JSON, convirtiendo los datetime a strings ISO.
-    Crea la carpeta si hace falta.
+class WriteBehind:
     """
-    # Asegurar directorio
-    path.parent.mkdir(parents=True, exist_ok=True)
+    Guardado diferido para handlers de la UI (sliders, tecleo, redibujos).
 
-    def _default(o):
-        if isinstance(o, datetime):
-            return o.isoformat()
-        # Añade aquí otros tipos si es necesario
-        raise TypeError(f"Type {o.__class__.__name__} not serializable")
+    put() solo apunta una copia de los datos; si llegan varias para el
+    mismo documento se queda la última. Un hilo de fondo las escribe
+    todas en una única transacción cuando pasan quiet_s segundos sin
+    cambios, y al salir de la app (atexit) se escribe lo pendiente.
 
-    text = json.dumps(
-        data,
-        ensure_ascii=False,
-        indent=2,
-        default=_default
-    )
-    path.write_text(text, encoding="utf-8")
+    Si la escritura falla (base de datos bloqueada, disco lleno…) nada
+    se pierde: se registra el error, el lote vuelve a la cola sin pisar
+    datos más nuevos y se reintenta pasados otros quiet_s segundos. Los
+    handlers de la UI nunca reciben la excepción.
+    """
 
+    def __init__(self, quiet_s: float = SAVE_QUIET_S):
+        self.quiet_s = quiet_s
+        self._pending: Dict[str, tuple[Callable[[Any], None], Any]] = {}
+        self._due = 0.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def put(self, key: str, write: Callable[[Any], None], data: Any,
+            merge: bool = False) -> None:
+        """merge=True: `data` (dict) se suma a lo pendiente con esa clave."""
+        with self._cond:
+            if merge and key in self._pending:
+                data = {**self._pending[key][1], **data}
+            self._pending[key] = (write, data)
+            self._due = time.monotonic() + self.quiet_s
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                delay = self._due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Escribe ya todo lo pendiente. Devuelve False si la escritura
+        falló (lo pendiente sigue en cola para el siguiente intento).
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return True
+            try:
+                with store.transaction():
+                    for write, data in batch.values():
+                        write(data)
+            except Exception as ex:
+                print(f"[utils] deferred save failed, will retry: {ex}")
+                with self._cond:
+                    # Lo que llegó mientras tanto es más nuevo: se queda
+                    for key, item in batch.items():
+                        self._pending.setdefault(key, item)
+                    self._due = max(self._due, time.monotonic() + self.quiet_s)
+                return False
+            return True
+
+    def discard(self) -> None:
+        """Olvida lo pendiente sin escribirlo (p. ej. al borrar los datos)."""
+        with self._flush_lock, self._cond:
+            self._pending.clear()
+
+
+pending_saves = WriteBehind()
+
+def _snapshot(data: Dict[str, Any], skip=()) -> Dict[str, Any]:
+    # Copia de lo que se guardará: la UI sigue modificando el original
+    return {
+        k: copy.deepcopy(v) for k, v in data.items()
+        if not k.startswith("_") and k not in skip
+    }
 
 # ------------------------------------------------------------------
-# Perfil y datos de usuario
+# Perfil y datos de usuario (repositorio sobre datastore)
 # ------------------------------------------------------------------
-def load_user_data(path: Path) -> Dict[str, Any]:
-    return load_json(path)
+# Claves de app_state que tienen su propia tabla en el almacén
+_USER_DATA_SKIP = ("treatments", "chat_messages")
 
-def save_user_data(data: Dict[str, Any], path: Path) -> None:
-    save_json(data, path)
+def load_user_data(doc: str = USER_DOC) -> Dict[str, Any]:
+    pending_saves.flush()
+    return store.load_document(doc)
+
+def save_user_data(data: Dict[str, Any], doc: str = USER_DOC) -> None:
+    """
+    Guarda el estado de la app en diferido (ver WriteBehind); solo se
+    escriben las claves que cambian. Las claves "_..." (controles de la
+    UI) no se guardan.
+    """
+    pending_saves.put(
+        doc,
+        lambda snap: store.save_document(doc, snap),
+        _snapshot(data, _USER_DATA_SKIP),
+    )
+
+def update_user_data(changes: Dict[str, Any], doc: str = USER_DOC) -> None:
+    """
+    Escribe ya solo las claves indicadas; si no se puede, quedan en la
+    cola de guardado diferido (después de lo que ya hubiera pendiente).
+    """
+    write = lambda c: store.update_document(doc, c)
+    if pending_saves.flush():
+        try:
+            write(changes)
+            return
+        except Exception as ex:
+            print(f"[utils] save failed, will retry: {ex}")
+    pending_saves.put(f"{doc}:update", write, copy.deepcopy(changes), merge=True)
+
+def user_data_exists() -> bool:
+    pending_saves.flush()
+    return store.document_exists(USER_DOC)
 
 def load_profile_data() -> Dict[str, Any]:
-    return load_json(PROFILE_PATH)
+    pending_saves.flush()
+    profile = store.load_document(PROFILE_DOC)
+    profile["studies"] = store.list_pdfs()
+    return profile
+
+def _write_profile(data: Dict[str, Any]) -> None:
+    store.save_document(PROFILE_DOC, data, skip=("studies",))
+    store.sync_pdfs(data.get("studies", []))
 
 def save_profile_data(data: Dict[str, Any]) -> None:
-    save_json(data, PROFILE_PATH)
+    """Guarda el perfil en diferido (ver WriteBehind)."""
+    pending_saves.put(PROFILE_DOC, _write_profile, _snapshot(data))
+
+def load_treatments() -> List[Dict[str, Any]]:
+    return store.list_treatments()
+
+def add_treatments(parsed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Guarda [{"medicine", "rule"}] en una transacción (todos o ninguno)."""
+    with store.transaction():
+        return [
+            {"id": store.add_treatment(p["medicine"], p["rule"]),
+             "medicine": p["medicine"], "rule": p["rule"]}
+            for p in parsed
+        ]
 
 def save_profile_photo(src_path: str) -> str:
     photos_dir = PHOTOS_DIR
@@ -130,90 +242,93 @@ def save_profile_photo(src_path: str) -> str:
 
 
 # ------------------------------------------------------------------
-# Chat data persistence
+# Wrappers: llaman al modelo (llm.gemma_wrapper → backend configurado;
+# el backend "stub" sustituye a los antiguos stubs de tests/offline)
 # ------------------------------------------------------------------
-def save_chat_data(data: List[Dict[str, str]], path: Path) -> None:
+async def stream_gemma_medichat_async(user_text: str, cancel=None):
     """
-    Guarda el historial de chat (solo roles user y assistant) en JSON,
-    limpiando emojis y markdown.
+    Envía al modelo el mensaje del usuario (el historial lo aporta
+    build_chat_prompt desde el chat persistido) y entrega los deltas de
+    la respuesta a medida que el modelo los genera.
     """
-    cleaned = []
-    for msg in data:
-        if msg.get("role") in ("user", "assistant"):
-            cleaned.append({
-                "role": msg["role"],
-                "content": clean_emoji_text(msg["content"])
-            })
-    save_json(cleaned, path)
-
+    async for delta in medichat_stream_async(user_text, cancel):
+        yield delta
 
-# ------------------------------------------------------------------
-# Emergency stubs (sincrónicos)
-# ------------------------------------------------------------------
+# Cada cuántos tokens se notifica el progreso de la generación
+PROGRESS_EVERY_TOKENS = 10
 
-async def run_gemma_emergency(payload: Dict[str, Any]) -> Dict[str, str]:
-    await asyncio.sleep(1)
-    count = len(payload.get("symptoms", []))
-    high = {"Atrial fibrillation", "previous Stroke/TIA", "Cardiovascular disease"}
-    score = count + (1 if any(a in high for a in payload.get("antecedentes", [])) else 0)
-    if score >= 4:
-        return {"level": "red", "message": "High risk, call emergency services."}
-    if score >= 2:
-        return {"level": "yellow", "message": "Medium risk, seek urgent attention."}
-    return {"level": "green", "message": "Low risk, remain attentive."}
+# Recomendación inmediata por nivel (fase 1, sin modelo)
+LEVEL_ADVICE = {
+    "red":    "High risk, call emergency services.",
+    "yellow": "Medium risk, seek urgent attention.",
+    "green":  "Low risk, remain attentive.",
+}
 
+_FENCE_RE   = re.compile(r"^```(?:json)?\s*")
+_HALF_UNICODE_RE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+_MESSAGE_RE = re.compile(r'"message"\s*:\s*"((?:[^"\\]|\\.)*)', re.S)
 
-# ------------------------------------------------------------------
-# Stub chat síncrono (tests/offline)
-# ------------------------------------------------------------------
-async def run_gemma_medichat(messages: List[Dict[str, str]]) -> str:
-    await asyncio.sleep(1)
-    if not messages:
-        return "Hello, I'm Gemi. How can I help you today?"
-    txt = messages[-1]["content"].lower()
-    if any(w in txt for w in ["fever", "temp"]):
-        return "If you have a fever, stay hydrated and monitor your temperature."
-    return "I am analyzing your query..."
+def emergency_level(payload: Dict[str, Any]) -> str:
+    """
+    Nivel green/yellow/red calculado por reglas (instantáneo).
+    """
+    return _score_payload(payload)
 
+def _partial_message(raw: str) -> str:
+    """
+    Extrae el campo "message" de un JSON que aún se está generando.
+    Si la salida no parece JSON, la devuelve tal cual.
+    """
+    text = _FENCE_RE.sub("", raw.lstrip())
+    if not text.startswith("{"):
+        return text
+    m = _MESSAGE_RE.search(text)
+    if not m:
+        return ""
+    body = m.group(1)
+    # Escape a medias al final del fragmento
+    body = _HALF_UNICODE_RE.sub("", body)
+    if (len(body) - len(body.rstrip("\\"))) % 2:
+        body = body[:-1]
+    try:
+        return json.loads(f'"{body}"')
+    except json.JSONDecodeError:
+        return body.replace("\\n", "\n").replace('\\"', '"')
 
-# ------------------------------------------------------------------
-# Wrappers: llaman al modelo real (llm.gemma_wrapper)
-# ------------------------------------------------------------------
-async def run_gemma_medichat_async(history: List[Dict[str, str]]) -> str:
-    """
-    Envía al modelo real la conversación completa como un prompt concatenado.
-    """
-    cleaned = [
-        {"role": m["role"], "content": clean_emoji_text(m["content"])}
-        for m in history
-    ]
-    lines: List[str] = []
-    for m in cleaned:
-        if m["role"] == "system":
-            lines.append(m["content"])
-        elif m["role"] == "user":
-            lines.append(f"Usuario: {m['content']}")
-        else:
-            lines.append(f"Gemi: {m['content']}")
-    prompt = "\n".join(lines)
-    reply = await medichat_async(prompt)
-    return clean_emoji_text(reply)
-
-async def run_gemma_emergency_async(payload: Dict[str, Any]) -> Dict[str, str]:
+async def _emergency_deltas(payload: Dict[str, Any], cancel, progress: Callable[[str], None]):
     level = _score_payload(payload)
+    progress(f"Risk score computed: {level.upper()}")
+
     extra_msg = (
         f"Calculated Level: {level.upper()}. "
         "Briefly explain why and offer 2-4 immediate steps for the patient."
     )
-    txt = await emergency_async(extra_user_message=extra_msg)
-    clean = clean_emoji_text(txt)
-    try:
-        data = json.loads(clean)
-        if isinstance(data, dict) and "level" in data and "message" in data:
-            return data
-    except json.JSONDecodeError:
-        pass
-    return {"level": level, "message": clean}
+    if not model_manager.is_ready:
+        progress("Loading model…")
+        await model_manager.wait_ready()
+    progress("Evaluating prompt…")
+    n = 0
+    async for delta in emergency_stream_async(
+        payload, extra_user_message=extra_msg, cancel=cancel, level=level
+    ):
+        n += 1
+        if n == 1 or n % PROGRESS_EVERY_TOKENS == 0:
+            progress(f"Generating report… {n}/{EMERGENCY_MAX_TOKENS} tokens")
+        yield delta
+
+async def stream_gemma_emergency_async(
+    payload: Dict[str, Any],
+    cancel=None,
+    on_progress: Optional[Callable[[str], None]] = None,
+):
+    """
+    Fase 2 de la evaluación: va entregando la explicación del modelo
+    (texto acumulado hasta el momento). El nivel lo da emergency_level().
+    """
+    raw = ""
+    async for delta in _emergency_deltas(payload, cancel, on_progress or (lambda _: None)):
+        raw += delta
+        yield clean_emoji_text(_partial_message(raw))
 
 
 # ------------------------------------------------------------------
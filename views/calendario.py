@@ -1,86 +1,36 @@
-import atexit
-import threading
-
 import flet as ft
 import calendar
-import re
 import winsound
-import json
 from datetime import timedelta, datetime
 from pathlib import Path
-from utils import save_json
+from utils import load_treatments, add_treatments
+from notifications import notification_scheduler
+from treatments import DoseIndex
+from treatment_parser import parse_treatment, parse_treatment_async
 import os
 
-# --- LIMPIEZA DE TIMERS AL SALIR ---
-TIMERS: list[threading.Timer] = []
-
-@atexit.register
-def _cleanup_timers():
-    """
-    Cancela todos los threading.Timer pendientes al cerrar la aplicación.
-    """
-    for t in TIMERS:
-        try:
-            t.cancel()
-        except Exception:
-            pass
-
 # ─── Carpeta de datos en APPDATA ────────────────────────────────
 APPDATA_DIR = Path(
     os.getenv("APPDATA", Path.home() / "AppData" / "Roaming")
 ) / "GemiASD"
 APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 
-# ─── Ruta al JSON de tareas de medicación ───────────────────────
-MED_TASKS_FILE = APPDATA_DIR / "medicine_tasks.json"
-
 # ------------------------------------------------------------------
 # LÓGICA DE DATOS
 # ------------------------------------------------------------------
+# Los tratamientos viven en el almacén SQLite (datastore) como reglas
+# de recurrencia (treatments.Recurrence): las tomas se calculan solo
+# para la ventana que se muestra o se va a avisar.
 
 def _load_treatments():
     """
-    Carga la lista de tratamientos, manejando formatos antiguos y nuevos.
+    Carga la lista de tratamientos [{"id", "medicine", "rule"}].
     """
-    if not MED_TASKS_FILE.exists():
-        return []
-    try:
-        with open(MED_TASKS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            treatments_list = [data]
-        elif isinstance(data, list):
-            treatments_list = data
-        else:
-            treatments_list = []
-        for treatment in treatments_list:
-            if isinstance(treatment, dict) and "schedule" in treatment:
-                treatment["schedule"] = [datetime.fromisoformat(dt) for dt in treatment["schedule"]]
-        return treatments_list
-    except (json.JSONDecodeError, TypeError):
-        try:
-            MED_TASKS_FILE.unlink()
-        except OSError:
-            pass
-        return []
+    return load_treatments()
 
 
-def _save_treatments(treatments):
-    """
-    Guarda la lista completa de tratamientos en el JSON.
-    """
-    APPDATA_DIR.mkdir(exist_ok=True)
-    serializable = []
-    for t in treatments:
-        serializable.append({
-            "medicine": t["medicine"],
-            "schedule": [dt.isoformat() for dt in t["schedule"]]
-        })
-    with open(MED_TASKS_FILE, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, indent=2, ensure_ascii=False)
-
 # ------------------------------------------------------------------
-# NOTIFICACIONES (threading.Timer)
+# NOTIFICACIONES (un único hilo, ver notifications.py)
 # ------------------------------------------------------------------
 
 def _show_notification(page: ft.Page, medicine_name: str):
@@ -96,134 +46,192 @@ def _show_notification(page: ft.Page, medicine_name: str):
     page.update()
 
 
-def schedule_notifications_for_treatment(page: ft.Page, treatment: dict):
-    medicine_name = treatment.get("medicine", "medication")
-    for dt in treatment.get("schedule", []):
-        delay = (dt - datetime.now()).total_seconds()
-        if delay > 0:
-            t = threading.Timer(
-                delay,
-                lambda mn=medicine_name: _show_notification(page, mn)
-            )
-            t.daemon = True         # ← marca el hilo como daemon
-            t.start()
-            TIMERS.append(t)
+# Los avisos se programan por ventanas (un tratamiento puede no tener
+# fin): al acabar una se programa la siguiente.
+NOTIFY_WINDOW = timedelta(hours=24)
 
-# ------------------------------------------------------------------
-# GENERACIÓN DE HORARIOS
-# ------------------------------------------------------------------
 
-def _generate_schedule(page: ft.Page, app_state: dict, instruction: str):
+def schedule_notifications_for_treatment(
+    page: ft.Page, treatment: dict, since: datetime, until: datetime
+) -> list[int]:
     """
-    Parsea la instrucción, añade el tratamiento, guarda y actualiza UI.
-    Luego programa notificaciones.
+    Programa un aviso por cada toma en [since, until); devuelve sus ids
+    para poder cancelarlos con notification_scheduler.cancel().
     """
-    pattern = r"(.+?)\s+every\s+(\d+)\s+(hours?)\s+x\s*(\d+)\s+(days?)"
-    m = re.match(pattern, instruction.strip(), re.IGNORECASE)
-    if not m:
-        page.snack_bar = ft.SnackBar(ft.Text(
-            "❌ Invalid format. Use: 'medication every 8 hours x 5 days'"
-        ))
-        page.snack_bar.open = True
-        page.update()
-        return
+    medicine_name = treatment.get("medicine", "medication")
+    return [
+        notification_scheduler.add(dt, _show_notification, page, medicine_name)
+        for dt in treatment["rule"].between(since, until)
+    ]
 
-    med = m.group(1).strip().capitalize()
-    hours = int(m.group(2))
-    days = int(m.group(4))
 
-    now = datetime.now()
-    total_doses = days * 24 // hours
-    schedule = [now + timedelta(hours=hours * i) for i in range(total_doses)]
+def _schedule_notification_window(page: ft.Page, app_state: dict, since: datetime | None = None):
+    """
+    Programa los avisos de la próxima ventana y, al final de esta, la
+    siguiente. Las tomas pendientes nunca pasan de una ventana.
+    """
+    since = since or datetime.now()
+    until = since + NOTIFY_WINDOW
+    app_state["_notify_until"] = until
+    for t in app_state.get("treatments", []):
+        schedule_notifications_for_treatment(page, t, since, until)
+    notification_scheduler.add(until, _schedule_notification_window, page, app_state, until)
 
-    new_treatment = {"medicine": med, "schedule": schedule}
-    app_state.setdefault("treatments", []).append(new_treatment)
-    _save_treatments(app_state["treatments"])
+# ------------------------------------------------------------------
+# GENERACIÓN DE HORARIOS
+# ------------------------------------------------------------------
 
-    page.snack_bar = ft.SnackBar(ft.Text(
-        f"✅ Added {total_doses} doses of {med}"
-    ))
+def _snack(page: ft.Page, text: str):
+    page.snack_bar = ft.SnackBar(ft.Text(text))
     page.snack_bar.open = True
     page.update()
 
-    _build_calendar_and_events(page, app_state)
-    schedule_notifications_for_treatment(page, new_treatment)
+
+async def _generate_schedule(page: ft.Page, app_state: dict, instruction: str):
+    """
+    Interpreta la instrucción (ver treatment_parser), añade el
+    tratamiento, guarda y actualiza UI. Luego programa notificaciones.
+    Corre con page.run_task: los errores se muestran aquí (si no, se
+    perderían) y el texto del usuario se deja en la caja.
+    """
+    # Reglas deterministas al instante; el modelo solo si no encajan
+    parsed = parse_treatment(instruction)
+    if parsed is None and instruction.strip():
+        _snack(page, "⏳ Interpreting your request…")
+        try:
+            parsed = await parse_treatment_async(instruction)
+        except Exception as ex:
+            print("Error parsing treatment:", ex)
+            _snack(page, "❌ Gemi is not available right now. Try again or use e.g. "
+                         "'Ibuprofen every 8 hours x 5 days'")
+            return
+    if not parsed:
+        _snack(page, "❌ Could not understand it. E.g. 'Ibuprofen every 8 hours x 5 days'")
+        return
+
+    # Solo se insertan los tratamientos nuevos, no se reescribe la lista
+    try:
+        added = add_treatments(parsed)
+    except Exception as ex:
+        print("Error saving treatment:", ex)
+        _snack(page, "❌ Could not save the treatment. Please try again.")
+        return
+    for new_treatment in added:
+        app_state.setdefault("treatments", []).append(new_treatment)
+        app_state["_dose_index"].add(new_treatment)
+
+    med = added[0]["medicine"]
+    totals = [t["rule"].total() for t in added]
+    if None in totals:
+        msg = f"✅ Added {med} (ongoing)"
+    else:
+        msg = f"✅ Added {sum(totals)} doses of {med}"
+
+    _refresh_calendar(page, app_state, snack=msg)
+    if "_notify_until" in app_state:
+        for new_treatment in added:
+            schedule_notifications_for_treatment(
+                page, new_treatment, datetime.now(), app_state["_notify_until"]
+            )
 
 # ------------------------------------------------------------------
-# CONSTRUCCIÓN DEL CALENDARIO
+# CUADRÍCULA DEL CALENDARIO
 # ------------------------------------------------------------------
+# La cuadrícula se crea una vez con 6×7 celdas fijas. Al cambiar de mes,
+# añadir un tratamiento o elegir un día solo se tocan las celdas cuyo
+# número o marca de tomas cambia, y se envían en un único update() de
+# esos controles (no page.update() de toda la vista).
 
-def _build_calendar_and_events(page: ft.Page, app_state: dict):
-    year = app_state.get("calendar_year")
-    month = app_state.get("calendar_month")
-    cal_container = app_state.get("_calendar_container")
-    cal_container.controls.clear()
+GRID_WEEKS = 6
 
-    all_doses = []
-    for t in app_state.get("treatments", []):
-        all_doses.extend(t.get("schedule", []))
 
+def _patch(page: ft.Page, controls: list):
+    """Un solo update() de los controles cambiados (si ya están en la página)."""
+    if controls and controls[0].page is not None:
+        page.update(*controls)
+
+
+def _build_calendar_grid(page: ft.Page, app_state: dict) -> ft.Column:
     days_header = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-    cal_container.controls.append(
+    rows = [
         ft.Row([
             ft.Text(d, weight=ft.FontWeight.BOLD, color=ft.Colors.CYAN_200)
             for d in days_header
         ], alignment=ft.MainAxisAlignment.SPACE_AROUND)
-    )
-
-    for week in calendar.monthcalendar(year, month):
+    ]
+    cells = []
+    for _ in range(GRID_WEEKS):
         row_cells = []
-        for day in week:
-            cell = ft.Container(width=40, height=40, alignment=ft.alignment.center)
-            if day != 0:
-                date_obj = datetime(year, month, day).date()
-                has_event = any(dt.date() == date_obj for dt in all_doses)
-                items = [ft.Text(str(day), color=ft.Colors.WHITE)]
-                if has_event:
-                    items.append(ft.Container(
-                        width=6, height=6, bgcolor=ft.Colors.CYAN_300, border_radius=3
-                    ))
-                cell.content = ft.Column(
-                    items,
+        for _ in range(7):
+            label = ft.Text("", color=ft.Colors.WHITE)
+            marker = ft.Container(
+                width=6, height=6, bgcolor=ft.Colors.CYAN_300, border_radius=3, visible=False
+            )
+            cell = {"day": 0, "has_doses": False, "label": label, "marker": marker}
+            cell["control"] = ft.Container(
+                content=ft.Column(
+                    [label, marker],
                     spacing=2,
                     horizontal_alignment=ft.CrossAxisAlignment.CENTER
-                )
-                cell.on_click = lambda _, d=day: _show_events_for_day(page, app_state, d)
-            row_cells.append(cell)
-        cal_container.controls.append(
-            ft.Row(row_cells, alignment=ft.MainAxisAlignment.SPACE_AROUND)
-        )
-
-    _show_events_for_day(
-        page,
-        app_state,
-        app_state.get("selected_day", datetime.now().day)
-    )
-    page.update()
+                ),
+                width=40, height=40, alignment=ft.alignment.center,
+                on_click=lambda _, c=cell: c["day"] and _on_day_click(page, app_state, c["day"]),
+            )
+            cells.append(cell)
+            row_cells.append(cell["control"])
+        rows.append(ft.Row(row_cells, alignment=ft.MainAxisAlignment.SPACE_AROUND))
 
-# ------------------------------------------------------------------
-# MUESTRA DE EVENTOS POR DÍA
-# ------------------------------------------------------------------
+    app_state["_calendar_cells"] = cells
+    app_state["_calendar_rows"] = rows[1:]
+    return ft.Column(rows, spacing=5, expand=True)
 
-def _show_events_for_day(page: ft.Page, app_state: dict, day: int):
-    app_state["selected_day"] = day
+
+def _render_grid(app_state: dict) -> list:
+    """Ajusta las celdas al mes actual; devuelve los controles que cambian."""
+    year = app_state.get("calendar_year")
+    month = app_state.get("calendar_month")
+    weeks = calendar.monthcalendar(year, month)
+    days = [day for week in weeks for day in week]
+    days += [0] * (GRID_WEEKS * 7 - len(days))
+
+    # Días con tomas del mes visible (índice por fecha, ver DoseIndex)
+    days_with_doses = app_state["_dose_index"].days_with_doses(year, month)
+
+    changed = []
+    for cell, day in zip(app_state["_calendar_cells"], days):
+        has_doses = day in days_with_doses
+        if cell["day"] != day:
+            cell["day"] = day
+            cell["label"].value = str(day) if day else ""
+            changed.append(cell["label"])
+        if cell["has_doses"] != has_doses:
+            cell["has_doses"] = has_doses
+            cell["marker"].visible = has_doses
+            changed.append(cell["marker"])
+
+    # Meses de 4 o 5 semanas: se ocultan las filas sobrantes
+    for i, row in enumerate(app_state["_calendar_rows"]):
+        if row.visible != (i < len(weeks)):
+            row.visible = i < len(weeks)
+            changed.append(row)
+    return changed
+
+
+def _render_events(app_state: dict) -> list:
+    """Tomas del día seleccionado; devuelve los controles que cambian."""
     ev_container = app_state.get("_events_container")
     ev_container.controls.clear()
 
-    date_sel = datetime(
-        app_state.get("calendar_year"),
-        app_state.get("calendar_month"),
-        day
-    ).date()
-    items = []
-    for t in sorted(app_state.get("treatments", []), key=lambda x: x.get("medicine", "")):
-        for dt in sorted(t.get("schedule", [])):
-            if dt.date() == date_sel:
-                items.append(ft.Text(
-                    f"• {dt.strftime('%H:%M')} — {t.get('medicine')}",
-                    color=ft.Colors.WHITE
-                ))
+    year = app_state.get("calendar_year")
+    month = app_state.get("calendar_month")
+    # El día elegido puede no existir en el mes nuevo (31 → febrero)
+    day = min(app_state.get("selected_day", 1), calendar.monthrange(year, month)[1])
+    app_state["selected_day"] = day
 
+    items = [
+        ft.Text(f"• {dt.strftime('%H:%M')} — {medicine}", color=ft.Colors.WHITE)
+        for dt, medicine, _ in app_state["_dose_index"].on_day(datetime(year, month, day).date())
+    ]
     if items:
         ev_container.controls.extend(items)
     else:
@@ -231,7 +239,25 @@ def _show_events_for_day(page: ft.Page, app_state: dict, day: int):
             "No scheduled doses for this day.",
             color=ft.Colors.WHITE, opacity=0.7
         ))
-    page.update()
+    return [ev_container]
+
+
+def _refresh_calendar(page: ft.Page, app_state: dict, extra: list = (), snack: str | None = None):
+    """
+    Cuadrícula + tomas del día + `extra`, en un único update(). Con
+    `snack` ese update() es el de la página: una SnackBar nueva solo
+    llega así, y lleva también las celdas ya cambiadas.
+    """
+    changed = [*extra, *_render_grid(app_state), *_render_events(app_state)]
+    if snack is None:
+        _patch(page, changed)
+    else:
+        _snack(page, snack)
+
+
+def _on_day_click(page: ft.Page, app_state: dict, day: int):
+    app_state["selected_day"] = day
+    _patch(page, _render_events(app_state))
 
 # ------------------------------------------------------------------
 # NAVEGACIÓN DE MESES
@@ -245,8 +271,9 @@ def _change_month(page: ft.Page, app_state: dict, delta: int):
     ) + timedelta(days=31 * delta)
     app_state["calendar_month"] = new_date.month
     app_state["calendar_year"] = new_date.year
-    app_state.get("_month_label").value = f"{calendar.month_name[new_date.month]} {new_date.year}"
-    _build_calendar_and_events(page, app_state)
+    month_lbl = app_state.get("_month_label")
+    month_lbl.value = f"{calendar.month_name[new_date.month]} {new_date.year}"
+    _refresh_calendar(page, app_state, [month_lbl])
 
 # ------------------------------------------------------------------
 # VISTA PRINCIPAL
@@ -258,34 +285,33 @@ def build_calendar_view(page: ft.Page, app_state: dict, set_tab: callable) -> ft
     """
     today = datetime.today()
     app_state["treatments"] = _load_treatments()
+    app_state["_dose_index"] = DoseIndex(app_state["treatments"])
     app_state.setdefault("calendar_year", today.year)
     app_state.setdefault("calendar_month", today.month)
     app_state.setdefault("selected_day", today.day)
 
     # Programa notificaciones al iniciar
-    if not app_state.get("notifications_scheduled", False):
-        for t in app_state["treatments"]:
-            schedule_notifications_for_treatment(page, t)
-        app_state["notifications_scheduled"] = True
+    # ("_…": no se guarda con el estado, hay que programarlas en cada arranque)
+    if "_notify_until" not in app_state:
+        _schedule_notification_window(page, app_state)
 
     input_box = ft.TextField(
-        label="E.g. Ibuprofen every 8 hours x 7 days",
+        label="E.g. Ibuprofen every 8 hours x 7 days, Dentist on Nov 3 at 10:30",
         expand=True,
         border_color=ft.Colors.CYAN_400
     )
     schedule_btn = ft.FilledButton(
         "Add Treatment",
-        on_click=lambda e: _generate_schedule(page, app_state, input_box.value)
+        on_click=lambda e: page.run_task(_generate_schedule, page, app_state, input_box.value)
     )
 
-    cal_container = ft.Column(spacing=5, expand=True)
+    cal_container = _build_calendar_grid(page, app_state)
     events_container = ft.Column(spacing=4, scroll=ft.ScrollMode.ALWAYS, expand=True)
     month_lbl = ft.Text(
         f"{calendar.month_name[app_state['calendar_month']]} {app_state['calendar_year']}",
         weight=ft.FontWeight.BOLD, size=18, color=ft.Colors.CYAN_300
     )
 
-    app_state["_calendar_container"] = cal_container
     app_state["_events_container"] = events_container
     app_state["_month_label"] = month_lbl
 
@@ -305,7 +331,7 @@ def build_calendar_view(page: ft.Page, app_state: dict, set_tab: callable) -> ft
         ft.Container(width=48)
     ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
 
-    _build_calendar_and_events(page, app_state)
+    _refresh_calendar(page, app_state)
 
     # Contenedor raíz scrollable si la ventana es pequeña
     return ft.Column(
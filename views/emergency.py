@@ -1,10 +1,16 @@
 # views/emergency.py
 import asyncio
+import threading
+import time
 from pathlib import Path
 
 import flet as ft
-from text_utils import clean_emoji_text
-from utils import run_gemma_emergency_async, save_user_data
+from utils import (
+    emergency_level,
+    stream_gemma_emergency_async,
+    update_user_data,
+    LEVEL_ADVICE,
+)
 import os
 
 # ─── Carpeta de datos en APPDATA ────────────────────────────────
@@ -13,8 +19,14 @@ APPDATA_DIR = Path(
 ) / "GemiASD"
 APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 
-# ─── JSON de perfil en APPDATA ──────────────────────────────────
-PROFILE_PATH = APPDATA_DIR / "gemi_user_data.json"
+# Intervalo mínimo entre refrescos de la explicación en streaming
+STREAM_REFRESH_S = 0.05
+
+LEVEL_COLORS = {
+    "green": ft.Colors.GREEN_400,
+    "yellow": ft.Colors.AMBER_400,
+    "red": ft.Colors.RED_400,
+}
 
 def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container:
     # ─── 1. BACK BUTTON ────────────────────────────────────────────────────
@@ -89,16 +101,16 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
         expand=True,
     )
 
-    # ─── 3. SPINNER + LOGS ─────────────────────────────────────────────────
-    loading_spinner = ft.ProgressRing(width=50, height=50, visible=False)
-    log_text = ft.Text("", color=ft.Colors.WHITE, text_align=ft.TextAlign.CENTER)
-    loading_box = ft.Column(
-        [loading_spinner, log_text],
-        spacing=20,
-        horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+    # ─── 3. ESTADO DE LA GENERACIÓN (SPINNER + LOG + STOP) ─────────────────
+    gen_state = {"cancel": None}
+    log_text = ft.Text("", color=ft.Colors.WHITE, size=12)
+    stop_btn = ft.TextButton("Stop", icon=ft.Icons.STOP_CIRCLE_OUTLINED)
+    status_row = ft.Row(
+        [ft.ProgressRing(width=14, height=14, stroke_width=2), log_text, stop_btn],
+        spacing=10,
         alignment=ft.MainAxisAlignment.CENTER,
+        vertical_alignment=ft.CrossAxisAlignment.CENTER,
         visible=False,
-        expand=True,
     )
 
     # ─── 4. BOTÓN “ANALIZAR” ───────────────────────────────────────────────
@@ -116,16 +128,23 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
             app_state["symptoms"][k] = False
         analyze_btn.disabled = True
 
+    def stop_generation(e=None):
+        if gen_state["cancel"] is not None:
+            gen_state["cancel"].set()
+            stop_btn.disabled = True
+            if e is not None:
+                page.update()
+
     def hide_result(e=None):
+        stop_generation()
         result_panel.visible = False
-        loading_box.visible = False
         reset_symptoms()
         symptoms_container.visible = True
         analyze_btn.visible = True
         page.update()
 
     async def on_copy_report(e):
-        page.set_clipboard(risk_msg_md.value)
+        page.set_clipboard(f"{risk_label.value}\n{advice_text.value}\n\n{risk_msg_md.value}")
         copy_btn.icon = ft.Icons.CHECK
         page.snack_bar = ft.SnackBar(ft.Text("Report copied to clipboard"), open=True)
         page.update()
@@ -136,6 +155,7 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
 
     # ─── 6. PANEL DE RESULTADO (CON TAMAÑO FIJO y SCROLL) ────────────────
     risk_label = ft.Text("", size=20, weight=ft.FontWeight.BOLD)
+    advice_text = ft.Text("", color=ft.Colors.WHITE, weight=ft.FontWeight.W_500)
     risk_msg_md = ft.Markdown(
         "",
         extension_set=ft.MarkdownExtensionSet.COMMON_MARK,
@@ -149,7 +169,7 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
             expand=True,
         ),
         width=500,   # ancho fijo
-        height=260,  # altura fija para scroll
+        height=200,  # altura fija para scroll
     )
 
     copy_btn = ft.IconButton(
@@ -178,6 +198,8 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
         content=ft.Column(
             [
                 risk_label,
+                advice_text,
+                status_row,
                 msg_scroller,
                 ft.Row(
                     [copy_btn, ok_btn],
@@ -185,7 +207,7 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
                     spacing=20,
                 ),
             ],
-            spacing=20,
+            spacing=12,
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
             alignment=ft.MainAxisAlignment.START,
         ),
@@ -203,44 +225,61 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
                 k for k, v in app_state["symptoms"].items() if v
             ],
         }
-        save_user_data(payload, PROFILE_PATH)
+        update_user_data(payload)
 
+        # Fase 1: nivel por reglas, instantáneo
+        level = emergency_level(payload)
+        risk_label.value = f"ALERT {level.upper()}"
+        risk_label.color = LEVEL_COLORS[level]
+        advice_text.value = LEVEL_ADVICE[level]
+        risk_msg_md.value = ""
+        log_text.value = "Gemi is writing the explanation…"
+        status_row.visible = True
+        stop_btn.disabled = False
         symptoms_container.visible = False
         analyze_btn.visible = False
-        loading_box.visible = True
-        loading_spinner.visible = True
+        result_panel.visible = True
         page.update()
 
-        for msg in [
-            "Analyzing background…",
-            "Analyzing age and gender…",
-            "Analyzing symptoms…",
-            "Processing current symptoms…",
-            "Generating risk level…",
-            "Generating risk message…",
-            "Preparing final report…",
-            "Generating final report…"
-        ]:
+        # Fase 2: explicación del modelo en streaming, cancelable
+        cancel = threading.Event()
+        gen_state["cancel"] = cancel
+
+        last_push = 0.0
+
+        def push(force: bool = False):
+            nonlocal last_push
+            now = time.perf_counter()
+            if force or now - last_push >= STREAM_REFRESH_S:
+                page.update()
+                last_push = now
+
+        def on_progress(msg: str):
+            # Las etapas (carga, evaluación del prompt) llegan antes de que
+            # el campo "message" tenga texto y justo antes de esperar: se
+            # muestran siempre. El contador de tokens ya llega espaciado.
             log_text.value = msg
-            page.update()
-            await asyncio.sleep(25)
+            push(force=True)
 
-        res = await run_gemma_emergency_async(payload)
+        try:
+            async for text in stream_gemma_emergency_async(payload, cancel, on_progress):
+                risk_msg_md.value = text
+                push()
+        except Exception as ex:
+            print("Error Gemi:", ex)
+            if not risk_msg_md.value:
+                risk_msg_md.value = "Explanation unavailable. Follow the recommendation above."
+        finally:
+            if gen_state["cancel"] is cancel:
+                gen_state["cancel"] = None
 
-        loading_box.visible = False
-        result_panel.visible = True
-        level = res.get("level", "yellow")
-        message = clean_emoji_text(res.get("message", ""))
-        risk_label.value = f"ALERT {level.upper()}"
-        risk_label.color = {
-            "green": ft.Colors.GREEN_400,
-            "yellow": ft.Colors.AMBER_400,
-            "red": ft.Colors.RED_400
-        }[level]
-        risk_msg_md.value = message
+        if cancel.is_set() and result_panel.visible:
+            risk_msg_md.value = (risk_msg_md.value + "\n\n*(generation stopped)*").strip()
+        status_row.visible = False
         page.update()
-        
+
     analyze_btn.on_click = analyze
+    stop_btn.on_click = stop_generation
 
     # ─── 8. LAYOUT FINAL ───────────────────────────────────────────────────
     return ft.Column(
@@ -254,7 +293,6 @@ def build_emergency_tab(page: ft.Page, app_state: dict, on_back) -> ft.Container
                     [
                         symptoms_container,
                         analyze_btn,
-                        loading_box,
                         result_panel,
                     ],
                     spacing=30,
@@ -1,7 +1,6 @@
 #main.py
 import flet as ft
 from pathlib import Path
-from utils import save_user_data
 from views.emergency import build_emergency_tab
 from views.medichat import build_medichat_tab
 from views.settings import build_settings_view
@@ -17,9 +16,6 @@ APPDATA_DIR = Path(
 ) / "GemiASD"
 APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 
-# ——— Ahora leemos/escribimos el JSON ahí ——————————————————
-DATA_PATH = APPDATA_DIR / "gemi_user_data.json"
-
 def build_main_view(page: ft.Page, app_state: dict, logo_data_uri: str) -> ft.View:
     # Inicializar estado
     selected = app_state.get("selected_tab", None)
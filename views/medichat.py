@@ -1,20 +1,25 @@
 #medichat
 import typing
 import re
-from pathlib import Path
+import time
 import threading
 
 import pyttsx3
 import flet as ft
 
 from text_utils import clean_emoji_text
-from utils import run_gemma_medichat_async, save_chat_data
-from llm.prompt_builder import build_chat_prompt  # prompt centralizado
+from utils import stream_gemma_medichat_async
+from llm.prompt_builder import load_chat_history  # historial centralizado
+from llm.scheduler import GenerationPreempted
+
+# Intervalo mínimo entre refrescos de la burbuja durante el streaming
+STREAM_REFRESH_S = 0.05
 
 # Se añade 'set_tab' para poder usarlo en el botón de volver
 def build_medichat_tab(page: ft.Page, app_state: dict, set_tab: typing.Callable) -> ft.Container:
     page.title = "Gemi ASD – Medical Assistant"
-    app_state.setdefault("chat_messages", [])
+    if "chat_messages" not in app_state:
+        app_state["chat_messages"] = load_chat_history()
 
     def max_bubble_w() -> float:
         w = getattr(page, "window_width", None) or page.width or 800
@@ -102,15 +107,17 @@ def build_medichat_tab(page: ft.Page, app_state: dict, set_tab: typing.Callable)
             alignment=ft.MainAxisAlignment.START,
         )
 
+        body_md = ft.Markdown(
+            msg["content"],
+            selectable=True,
+            extension_set=ft.MarkdownExtensionSet.COMMON_MARK,
+            code_theme="atom-one-dark",
+        )
+
         bubble = ft.Container(
             content=ft.Column(
                 [
-                    ft.Markdown(
-                        msg["content"],
-                        selectable=True,
-                        extension_set=ft.MarkdownExtensionSet.COMMON_MARK,
-                        code_theme="atom-one-dark",
-                    ),
+                    body_md,
                     buttons_row,
                 ],
                 tight=True,
@@ -122,9 +129,11 @@ def build_medichat_tab(page: ft.Page, app_state: dict, set_tab: typing.Callable)
             width=None if is_user else max_bubble_w(),
         )
 
+        # data → Markdown del cuerpo, para poder ir ampliándolo en streaming
         return ft.Row(
             [bubble],
             alignment=ft.MainAxisAlignment.END if is_user else ft.MainAxisAlignment.START,
+            data=body_md,
         )
 
     # ListView de mensajes
@@ -161,27 +170,43 @@ def build_medichat_tab(page: ft.Page, app_state: dict, set_tab: typing.Callable)
         lv.controls.append(typing)
         page.update()
 
-        # Construir prompt y llamar al LLM local
-        history, _ = build_chat_prompt(current_input)
+        # Llamar al LLM local en streaming (el prompt se arma en llm.prompt_builder)
+        bot_msg = {"role": "assistant", "content": ""}
+        bot_row = None
+        last_push = 0.0
         try:
-            bot_reply = await run_gemma_medichat_async(history)
+            async for delta in stream_gemma_medichat_async(current_input):
+                bot_msg["content"] += delta
+                if bot_row is None:
+                    # Primer token: la burbuja sustituye al indicador
+                    lv.controls.remove(typing)
+                    bot_row = render_message(bot_msg)
+                    lv.controls.append(bot_row)
+                # Limitar los refrescos a ~20 por segundo
+                if time.perf_counter() - last_push >= STREAM_REFRESH_S:
+                    bot_row.data.value = bot_msg["content"]
+                    page.update()
+                    last_push = time.perf_counter()
+        except GenerationPreempted:
+            # Una evaluación de emergencia tiene prioridad sobre el chat
+            bot_msg["content"] += (
+                "\n\n*(Interrupted by an emergency assessment. Please ask again.)*"
+            )
         except Exception as ex:
             print("Error Gemi:", ex)
-            bot_reply = "I'm sorry, I can't respond at this moment."
+            if not bot_msg["content"]:
+                bot_msg["content"] = "I'm sorry, I can't respond at this moment."
 
-        # Mostrar assistant
-        lv.controls.remove(typing)
-        bot_msg = {"role": "assistant", "content": clean_emoji_text(bot_reply)}
+        # Mostrar assistant (texto final completo)
+        bot_msg["content"] = clean_emoji_text(bot_msg["content"].strip())
+        if bot_row is None:
+            lv.controls.remove(typing)
+            bot_row = render_message(bot_msg)
+            lv.controls.append(bot_row)
+        bot_row.data.value = bot_msg["content"]
         app_state["chat_messages"].append(bot_msg)
-        lv.controls.append(render_message(bot_msg))
         page.update()
 
-        # Persistir solo user+assistant en chat_data.json
-        save_chat_data(
-            app_state["chat_messages"],
-            Path(__file__).parent.parent / "data" / "chat_data.json",
-        )
-
     # Input y botón de enviar
     input_field = ft.TextField(
         expand=True, multiline=True, max_lines=4, filled=True,
@@ -2,7 +2,7 @@
 import flet as ft
 import os
 from pathlib import Path
-from utils import save_user_data, load_user_data, clear_user_data
+from utils import save_user_data, load_user_data, user_data_exists, clear_user_data
 from views.medichat import build_medichat_tab
 
 # ─── Carpeta de datos en APPDATA ───────────────────────────────
@@ -12,16 +12,9 @@ APPDATA_DIR = (
 )
 APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 
-# ─── Rutas de perfil y chat en APPDATA ─────────────────────────
-PROFILE_PATH = APPDATA_DIR / "gemi_user_data.json"
-CHAT_PATH    = APPDATA_DIR / "chat_data.json"
-
-# Ruta fija al JSON de datos
-data_path = Path(__file__).parent.parent / "data" / "gemi_user_data.json"
-
 # --- Vista de elección de sesión: crear o continuar ---
 def build_session_choice_view(page: ft.Page, app_state: dict) -> ft.View:
-    profile_exists = PROFILE_PATH.exists() and PROFILE_PATH.stat().st_size > 0
+    profile_exists = user_data_exists()
 
     def on_create(e: ft.ControlEvent):
         clear_user_data()
@@ -81,7 +74,7 @@ def on_create(page: ft.Page, app_state: dict):
 
 def on_continue(page: ft.Page, app_state: dict):
     # Carga perfil existente y va al chat
-    data = load_user_data(data_path)
+    data = load_user_data()
     app_state.update(data)
     page.go("/main")
 
@@ -95,7 +88,6 @@ def build_gender_view(page: ft.Page, app_state: dict) -> ft.View:
 
     def on_gender_change(e: ft.ControlEvent):
         app_state["gender"] = e.control.value
-        save_user_data(app_state, data_path)
         next_btn.disabled = False
         page.update()
 
@@ -151,7 +143,6 @@ def build_age_view(page: ft.Page, app_state: dict) -> ft.View:
         new_age = int(e.control.value)
         app_state["age"] = new_age
         label.value = str(new_age)
-        save_user_data(app_state, data_path)
         page.update()
 
     slider = ft.Slider(
@@ -238,7 +229,7 @@ def build_background_view(page: ft.Page, app_state: dict) -> ft.View:
 
     def on_next(e: ft.ControlEvent):
         app_state["background"] = {k: v for k, v in selected.items() if v}
-        save_user_data(app_state, PROFILE_PATH)
+        save_user_data(app_state)
         page.go("/main")
 
     next_btn = ft.FilledButton(
@@ -4,6 +4,16 @@ import asyncio
 import os
 from pathlib import Path
 from utils import clear_user_data, save_user_data
+from llm.backends import BACKENDS
+from llm.model_manager import model_manager
+from llm.response_cache import emergency_cache
+from llm.runtime_profile import (
+    detect_machine,
+    default_profile,
+    load_overrides,
+    save_overrides,
+    MIN_VALUES,
+)
 
 # ────────── Carpeta de datos en APPDATA ────────────────────────
 APPDATA_DIR = Path(
@@ -14,7 +24,6 @@ APPDATA_DIR.mkdir(parents=True, exist_ok=True)
 # ────────── Subcarpetas y archivos de usuario ──────────────────
 PDF_DIR         = APPDATA_DIR / "pdfs"
 PHOTOS_DIR      = APPDATA_DIR / "photos"
-USER_DATA_FILE  = APPDATA_DIR / "gemi_user_data.json"
 
 async def _perform_reset(page: ft.Page, app_state: dict):
     """Borra JSON, PDFs y fotos, limpia estado y reinicia al splash (/)."""
@@ -48,19 +57,20 @@ def build_settings_view(page: ft.Page, app_state: dict) -> ft.View:
     """
     Vista de Configuración:
       • Notificaciones por correo
+      • Perfil de inferencia (hilos, batch, contexto, mmap/mlock)
       • Restablecer aplicación con spinner
       • Botón de retroceso
     """
     def on_toggle_notify(e: ft.ControlEvent):
         app_state["notify_enabled"] = e.control.value
-        save_user_data(app_state, USER_DATA_FILE)
+        save_user_data(app_state)
         email_field.disabled = not e.control.value
         send_test_btn.disabled = not e.control.value
         page.update()
 
     def on_email_change(e: ft.ControlEvent):
         app_state["notify_email"] = e.control.value
-        save_user_data(app_state, USER_DATA_FILE)
+        save_user_data(app_state)
 
     def on_send_test(e: ft.ControlEvent):
         addr = app_state.get("notify_email", "").strip()
@@ -98,6 +108,132 @@ def build_settings_view(page: ft.Page, app_state: dict) -> ft.View:
         disabled=not app_state.get("notify_enabled", False),
     )
 
+    # ─── Perfil de inferencia ──────────────────────────────────
+    machine   = detect_machine()
+    auto      = default_profile(machine)
+    overrides = load_overrides()
+
+    machine_text = ft.Text(
+        f"{machine['physical_cores']} physical cores · "
+        f"{machine['logical_cores']} threads · "
+        f"{machine['total_memory'] / 1024 ** 3:.1f} GB RAM",
+        color=ft.Colors.WHITE, opacity=0.7,
+    )
+
+    def _model_status() -> str:
+        st = model_manager.status()
+        if st["state"] == "ready":
+            text = f"Model loaded in {st['load_seconds']:.1f} s"
+            if st["warmup_seconds"]:
+                text += f" (warm-up {st['warmup_seconds']:.1f} s)"
+            return text
+        return {"idle": "Model not loaded yet", "loading": "Model loading…",
+                "error": "Model failed to load"}[st["state"]]
+
+    model_text = ft.Text(_model_status(), color=ft.Colors.WHITE, opacity=0.7)
+
+    def _cache_status() -> str:
+        st = emergency_cache.stats()
+        return (f"Emergency cache: {st['entries']} answers · "
+                f"{st['hits']} hits / {st['misses']} misses this session")
+
+    cache_text = ft.Text(_cache_status(), color=ft.Colors.WHITE, opacity=0.7)
+
+    def _num_field(key: str, label: str) -> ft.TextField:
+        return ft.TextField(
+            label=label,
+            value=str(overrides[key]) if key in overrides else "",
+            hint_text=f"auto: {auto[key]}",
+            keyboard_type=ft.KeyboardType.NUMBER,
+            input_filter=ft.NumbersOnlyInputFilter(),
+            width=160,
+            content_padding=ft.padding.symmetric(vertical=4, horizontal=8),
+        )
+
+    def _flag_switch(key: str, label: str) -> ft.Switch:
+        return ft.Switch(
+            label=label,
+            value=overrides.get(key, auto[key]),
+            thumb_color=ft.Colors.CYAN_300,
+            track_color=ft.Colors.BLUE_GREY_700,
+        )
+
+    backend_dd = ft.Dropdown(
+        label="Backend",
+        value=overrides.get("backend", auto["backend"]),
+        options=[ft.dropdown.Option(b) for b in BACKENDS],
+        width=160,
+    )
+    server_field = ft.TextField(
+        label="Server URL",
+        value=overrides.get("server_url", ""),
+        hint_text="http://127.0.0.1:8080",
+        expand=True,
+        content_padding=ft.padding.symmetric(vertical=4, horizontal=8),
+    )
+
+    num_fields = {
+        "n_threads": _num_field("n_threads", "Threads"),
+        "n_threads_batch": _num_field("n_threads_batch", "Batch threads"),
+        "n_batch": _num_field("n_batch", "Batch size"),
+        "n_ctx": _num_field("n_ctx", "Context (tokens)"),
+        "chat_prompt_budget": _num_field("chat_prompt_budget", "Chat history (tokens)"),
+    }
+    flag_switches = {
+        "use_mmap": _flag_switch("use_mmap", "Memory-map model"),
+        "use_mlock": _flag_switch("use_mlock", "Lock model in RAM"),
+        "flash_attn": _flag_switch("flash_attn", "Flash attention"),
+        "persist_warmup": _flag_switch("persist_warmup", "Keep warm-up on disk"),
+    }
+
+    def _show_snack(msg: str):
+        page.snack_bar = ft.SnackBar(ft.Text(msg))
+        page.snack_bar.open = True
+        page.update()
+
+    def on_save_runtime(e: ft.ControlEvent):
+        new = {k: int(f.value) for k, f in num_fields.items() if f.value}
+        for k, v in new.items():
+            if v < MIN_VALUES[k]:
+                _show_snack(f"{num_fields[k].label} must be at least {MIN_VALUES[k]}.")
+                return
+        # Los interruptores solo se guardan si difieren del automático
+        new.update({k: sw.value for k, sw in flag_switches.items() if sw.value != auto[k]})
+        if backend_dd.value != auto["backend"]:
+            new["backend"] = backend_dd.value
+        if server_field.value:
+            new["server_url"] = server_field.value.strip()
+        save_overrides(new)
+        _show_snack("Inference settings saved. Restart Gemi to apply them.")
+
+    def on_clear_cache(e: ft.ControlEvent):
+        emergency_cache.clear()
+        cache_text.value = _cache_status()
+        _show_snack("Emergency cache cleared.")
+
+    def on_reset_runtime(e: ft.ControlEvent):
+        save_overrides({})
+        for f in num_fields.values():
+            f.value = ""
+        for k, sw in flag_switches.items():
+            sw.value = auto[k]
+        backend_dd.value = auto["backend"]
+        server_field.value = ""
+        _show_snack("Inference settings reset to automatic. Restart Gemi to apply them.")
+
+    runtime_buttons = ft.Row(
+        [
+            ft.FilledButton(
+                "Save inference settings",
+                on_click=on_save_runtime,
+                bgcolor=ft.Colors.CYAN_300,
+                color=ft.Colors.BLACK,
+            ),
+            ft.TextButton("Use automatic values", on_click=on_reset_runtime),
+        ],
+        spacing=10,
+    )
+
     dlg = ft.AlertDialog(modal=True)
 
     def on_confirm(e: ft.ControlEvent):
@@ -150,6 +286,18 @@ def build_settings_view(page: ft.Page, app_state: dict) -> ft.View:
                 email_field,
                 send_test_btn,
                 ft.Divider(opacity=0.3),
+                ft.Text("Inference", weight=ft.FontWeight.BOLD, color=ft.Colors.CYAN_200),
+                machine_text,
+                model_text,
+                ft.Row([backend_dd, server_field], spacing=10),
+                ft.Row(list(num_fields.values()), spacing=10, wrap=True),
+                ft.Row(list(flag_switches.values()), spacing=20, wrap=True),
+                runtime_buttons,
+                ft.Row(
+                    [cache_text, ft.TextButton("Clear emergency cache", on_click=on_clear_cache)],
+                    spacing=10, wrap=True,
+                ),
+                ft.Divider(opacity=0.3),
                 reset_btn,
             ],
             spacing=20,
@@ -162,4 +310,5 @@ def build_settings_view(page: ft.Page, app_state: dict) -> ft.View:
         route="/settings",
         controls=[app_bar, body],
         bgcolor=ft.Colors.BLUE_GREY_900,
+        scroll=ft.ScrollMode.ADAPTIVE,
     )